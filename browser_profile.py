@@ -0,0 +1,117 @@
+from urllib.parse import quote
+from urllib.request import getproxies
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Per-site scraping profile, keyed by the load_site() index.
+# block_images/block_fonts: whether the site's selectors still work without them
+# blocklist: hosts whose requests are refused before they leave the browser
+# settle_time: seconds to let the site's scripts fill in the quoted values after load
+SITE_PROFILES = {
+    0: {
+        'name': 'google',
+        'block_images': True,
+        'block_fonts': True,
+        'blocklist': ['doubleclick.net', 'googleadservices.com', 'googlesyndication.com', 'google-analytics.com',
+                      'googletagmanager.com', 'ytimg.com', 'youtube.com'],
+        'settle_time': 0,
+    },
+    1: {
+        'name': 'changenow',
+        'block_images': True,
+        'block_fonts': True,
+        'blocklist': ['google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'mc.yandex.ru',
+                      'hotjar.com', 'intercom.io', 'intercomcdn.com', 'facebook.net', 'clarity.ms',
+                      'fonts.googleapis.com', 'fonts.gstatic.com'],
+        'settle_time': 3,
+    },
+    2: {
+        'name': 'changenow',
+        'block_images': True,
+        'block_fonts': True,
+        'blocklist': ['google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'mc.yandex.ru',
+                      'hotjar.com', 'intercom.io', 'intercomcdn.com', 'facebook.net', 'clarity.ms',
+                      'fonts.googleapis.com', 'fonts.gstatic.com'],
+        'settle_time': 3,
+    },
+}
+
+# Wait for DOMContentLoaded only; the selectors are waited for explicitly afterwards
+LEAN_PAGE_LOAD_STRATEGY = 'eager'
+
+# Preferences applied to every lean profile regardless of site
+LEAN_BASE_PREFERENCES = {
+    'media.autoplay.default': 5,
+    'media.autoplay.blocking_policy': 2,
+    'privacy.trackingprotection.enabled': True,
+    'privacy.trackingprotection.socialtracking.enabled': True,
+    'network.prefetch-next': False,
+    'network.dns.disablePrefetch': True,
+    'network.http.speculative-parallel-limit': 0,
+    'browser.sessionhistory.max_total_viewers': 0,
+    'browser.sessionhistory.max_entries': 2,
+    'browser.cache.disk.enable': False,
+    'dom.ipc.processCount': 1,
+}
+
+# Sums up what the current page and its sub-resources transferred
+PAGE_STATS_SCRIPT = """
+var entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+var bytes = 0;
+for (var i = 0; i < entries.length; i++) {
+    bytes += entries[i].transferSize || 0;
+}
+return {requests: entries.length, bytes: bytes};
+"""
+
+
+# Function to build a proxy auto-config script that sends blocklisted hosts to a closed local port
+def build_blocklist_pac(blocklist):
+    hosts = ', '.join(f'"{host}"' for host in sorted(set(blocklist)))
+    return ("function FindProxyForURL(url, host) {"
+            f" var blocked = [{hosts}];"
+            " for (var i = 0; i < blocked.length; i++) {"
+            " if (host == blocked[i] || dnsDomainIs(host, '.' + blocked[i])) { return 'PROXY 127.0.0.1:9'; }"
+            " }"
+            " return 'DIRECT'; }")
+
+
+# Function to tell whether the system routes traffic through a proxy, which Firefox follows by default.
+# getproxies() covers proxy environment variables and the Windows and macOS proxy settings; on Windows an
+# automatic configuration script is set separately.
+def system_proxy_configured():
+    if getproxies():
+        return True
+    if os.name == 'nt':
+        import winreg
+        try:
+            with winreg.OpenKey(winreg.HKEY_CURRENT_USER,
+                                r'Software\Microsoft\Windows\CurrentVersion\Internet Settings') as key:
+                return bool(winreg.QueryValueEx(key, 'AutoConfigURL')[0])
+        except OSError:
+            return False
+    return False
+
+
+# Function to merge the site profiles into one set of Firefox preferences, since one browser loads every site.
+# Resources are only blocked if every site can do without them.
+def build_lean_preferences(site_profiles=SITE_PROFILES):
+    profiles = list(site_profiles.values())
+    preferences = dict(LEAN_BASE_PREFERENCES)
+    if all(profile['block_images'] for profile in profiles):
+        preferences['permissions.default.image'] = 2
+    if all(profile['block_fonts'] for profile in profiles):
+        preferences['browser.display.use_document_fonts'] = 0
+        preferences['gfx.downloadable_fonts.enabled'] = False
+    blocklist = [host for profile in profiles for host in profile['blocklist']]
+    # The blocklist is applied through a PAC script, which would replace the system proxy, so it is left out
+    # whenever one is configured
+    if blocklist and system_proxy_configured():
+        logger.info("System proxy configured, so blocklisted hosts are not blocked.")
+    elif blocklist:
+        preferences['network.proxy.type'] = 2
+        preferences['network.proxy.autoconfig_url'] = ('data:application/x-ns-proxy-autoconfig,'
+                                                       + quote(build_blocklist_pac(blocklist)))
+    return preferences
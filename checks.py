@@ -0,0 +1,7 @@
+# Shared by the *_check.py scripts, which run the code against local stand-ins and exit non-zero on a failure
+
+
+# Function to check one condition, printing it and returning whether it held
+def check(description, passed):
+    print(f"{'ok  ' if passed else 'FAIL'} {description}")
+    return passed
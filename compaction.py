@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_PRICE_BAND = 5.0
+
+
+# Function to give the start of the quarter-hour a date_time string falls in, as a date_time string
+def quarter_hour_start(date_time):
+    return f"{date_time[:14]}{(int(date_time[14:16]) // 15) * 15:02d}:00"
+
+
+# Function to give the lower bound of the price band an item price falls in
+def price_band(price, band_width):
+    return math.floor(price / band_width) * band_width
+
+
+def _group_key(entry, band_width):
+    band = entry['price_band'] if entry.get('aggregate') else price_band(entry['initial_product_price'], band_width)
+    return (quarter_hour_start(entry['date_time']), entry['fiat_currency'], entry['initial_crypto'],
+            entry['final_crypto'], band)
+
+
+# Function to turn a raw entry into a one-entry aggregate so raw entries and aggregates combine the same way
+def _as_aggregate(entry, band_width):
+    if entry.get('aggregate'):
+        return dict(entry)
+    return {
+        'date_time': quarter_hour_start(entry['date_time']),
+        'final_estimate': entry['final_estimate'],
+        'initial_product_price': entry['initial_product_price'],
+        'fiat_currency': entry['fiat_currency'],
+        'initial_crypto': entry['initial_crypto'],
+        'final_crypto': entry['final_crypto'],
+        'aggregate': True,
+        'price_band': price_band(entry['initial_product_price'], band_width),
+        'count': 1,
+        'min_estimate': entry['final_estimate'],
+        'max_estimate': entry['final_estimate'],
+        # Mean fees of the entries, kept only while every one of them stored its legs, so the aggregate can
+        # still be repriced for a fee change (the legs themselves can't be averaged into a valid estimate)
+        'xmr_fees': entry.get('xmr_fees') if entry.get('legs') else None,
+    }
+
+
+def _combine(total, other):
+    count = total['count'] + other['count']
+    for field in ('final_estimate', 'initial_product_price'):
+        total[field] = (total[field] * total['count'] + other[field] * other['count']) / count
+    if total.get('xmr_fees') is None or other.get('xmr_fees') is None:
+        total['xmr_fees'] = None
+    else:
+        total['xmr_fees'] = (total['xmr_fees'] * total['count'] + other['xmr_fees'] * other['count']) / count
+    total['min_estimate'] = min(total['min_estimate'], other['min_estimate'])
+    total['max_estimate'] = max(total['max_estimate'], other['max_estimate'])
+    total['count'] = count
+
+
+# Function to flush one quarter-hour's groups; an existing aggregate replaces the raw entries of its group
+def _flush_quarter(raw_groups, existing_aggregates, stats):
+    stats['compacted'] += sum(group['count'] for key, group in raw_groups.items() if key not in existing_aggregates)
+    raw_groups.update(existing_aggregates)
+    return list(raw_groups.values())
+
+
+# Function to keep raw entries inside the retention window and roll older ones into per quarter-hour aggregates
+# (count, mean, min and max per currency triple and price band). Aggregates keep the entry fields analysis reads,
+# with final_estimate and initial_product_price as count-weighted means. Aggregates drop the scraped legs, so they
+# can be repriced for other fees (from their mean xmr_fees) but not for other item prices.
+# Once a quarter-hour has an aggregate, late raw entries for it are assumed to be counted already, and of two
+# aggregates for the same group the one covering more entries wins, so re-compacting merged data never double counts.
+# Takes and yields entries in time order, holding only one quarter-hour at a time.
+def compact_entries(entries, retention_days=DEFAULT_RETENTION_DAYS, band_width=DEFAULT_PRICE_BAND, now=None):
+    cutoff = ((now or datetime.now()) - timedelta(days=retention_days)).strftime(DATE_FORMAT)
+    # Compact whole quarter-hours only, so a quarter never ends up split between raw entries and an aggregate
+    cutoff = quarter_hour_start(cutoff)
+    stats = {'compacted': 0}
+    current_quarter = None
+    existing_aggregates = {}
+    raw_groups = {}
+    for entry in entries:
+        quarter = quarter_hour_start(entry['date_time'])
+        if quarter != current_quarter:
+            # Input is in time order, so the previous quarter-hour is complete
+            yield from _flush_quarter(raw_groups, existing_aggregates, stats)
+            current_quarter, existing_aggregates, raw_groups = quarter, {}, {}
+        if entry['date_time'] >= cutoff:
+            yield entry
+            continue
+        key = _group_key(entry, band_width)
+        if entry.get('aggregate'):
+            current = existing_aggregates.get(key)
+            if current is None or entry['count'] > current['count']:
+                existing_aggregates[key] = entry
+        elif key in raw_groups:
+            _combine(raw_groups[key], _as_aggregate(entry, band_width))
+        else:
+            raw_groups[key] = _as_aggregate(entry, band_width)
+    yield from _flush_quarter(raw_groups, existing_aggregates, stats)
+
+    if stats['compacted']:
+        logger.info(f"Compacted {stats['compacted']} entries older than {cutoff} into quarter-hour aggregates.")
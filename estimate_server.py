@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from collections import OrderedDict
+import asyncio
+import logging
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_TTL = 60.0
+# Most distinct queries kept cached at once, so clients sending many amounts can't grow memory without bound
+DEFAULT_CACHE_SIZE = 256
+
+
+# Shares one in-flight fetch between every caller asking for the same key, then caches the result briefly.
+# Expired results are dropped whenever a new one is stored, and past max_size the least recently used goes.
+class SingleFlightCache:
+    def __init__(self, ttl=DEFAULT_CACHE_TTL, max_size=DEFAULT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.results = OrderedDict()
+        self.in_flight = {}
+        self.fetches = 0
+
+    async def get(self, key, fetch):
+        cached = self.results.get(key)
+        if cached and time.monotonic() - cached[0] < self.ttl:
+            self.results.move_to_end(key)
+            return cached[1]
+        if key not in self.in_flight:
+            self.in_flight[key] = asyncio.ensure_future(self._fetch(key, fetch))
+        # Shield so one client disconnecting doesn't cancel the fetch for everyone else
+        return await asyncio.shield(self.in_flight[key])
+
+    async def _fetch(self, key, fetch):
+        self.fetches += 1
+        try:
+            result = await fetch()
+            self._store(key, result)
+            return result
+        finally:
+            del self.in_flight[key]
+
+    def _store(self, key, result):
+        now = time.monotonic()
+        self.results.pop(key, None)
+        # Least recently used first; a stale result behind a fresh one waits its turn, max_size still bounds them
+        while self.results:
+            oldest_key, (stored, _) = next(iter(self.results.items()))
+            if now - stored < self.ttl and len(self.results) < self.max_size:
+                break
+            del self.results[oldest_key]
+        self.results[key] = (now, result)
+
+
+# Local HTTP server exposing estimates and best times, backed by one scraping worker
+class EstimateServer:
+    # fetch_legs(fiat, initial, final, item_price) -> dict of scraped legs, run on a single worker thread
+    # compute_estimate(legs, balance, xmr_fees) -> final trade price
+    # best_time(item_price, fiat, initial, final) -> (datetime, price) or None, run off the scraping worker
+    # default_balance, default_fees: used when a query leaves out balance or fees
+    def __init__(self, fetch_legs, compute_estimate, best_time, cache_ttl=DEFAULT_CACHE_TTL, default_balance=0.0,
+                 default_fees=0.0):
+        self.fetch_legs = fetch_legs
+        self.compute_estimate = compute_estimate
+        self.best_time = best_time
+        self.default_balance = default_balance
+        self.default_fees = default_fees
+        self.cache = SingleFlightCache(cache_ttl)
+        # One worker, since every fetch drives the same browser
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='estimate-backend')
+
+    async def _run_in_backend(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def estimate(self, query):
+        fiat, initial, final = query['fiat'], query['initial'], query['final']
+        item_price = float(query['amount'])
+        key = ('legs', fiat, initial, final, item_price)
+        legs = await self.cache.get(key, lambda: self._run_in_backend(self.fetch_legs, fiat, initial, final,
+                                                                       item_price))
+        # Balance and fees are per client, so only the scraped legs are shared
+        estimate = self.compute_estimate(legs, float(query.get('balance', self.default_balance)),
+                                         float(query.get('fees', self.default_fees)))
+        return {'estimate': estimate, 'legs': legs}
+
+    async def best(self, query):
+        fiat, initial, final = query['fiat'], query['initial'], query['final']
+        item_price = float(query['amount'])
+        key = ('best', fiat, initial, final, item_price)
+        # Only reads local data, so it runs on its own thread rather than queueing behind scrapes
+        result = await self.cache.get(key, lambda: asyncio.to_thread(self.best_time, item_price, fiat, initial,
+                                                                      final))
+        if result is None:
+            return {'best_time': None, 'best_price': None}
+        return {'best_time': result[0].strftime('%H:%M'), 'best_price': round(result[1], 2)}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Skip the headers, no endpoint needs them
+            while (await reader.readline()).strip():
+                pass
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            url = urlsplit(target)
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            if method != 'GET':
+                status, body = 405, {'error': 'Only GET is supported.'}
+            elif url.path == '/estimate':
+                status, body = 200, await self.estimate(query)
+            elif url.path == '/best-time':
+                status, body = 200, await self.best(query)
+            elif url.path == '/health':
+                status, body = 200, {'status': 'ok', 'backend_fetches': self.cache.fetches}
+            else:
+                status, body = 404, {'error': f"Unknown path {url.path}"}
+        except (KeyError, ValueError) as e:
+            status, body = 400, {'error': f"Bad request: {e}"}
+        except Exception as e:
+            logger.error(f"Request failed: {type(e).__name__}: {e}")
+            status, body = 502, {'error': str(e)}
+
+        payload = json.dumps(body).encode('utf-8')
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}.get(status, 'Error')
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1') + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f"Estimate server listening on {host}:{port}.")
+        async with server:
+            await server.serve_forever()
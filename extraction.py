@@ -0,0 +1,97 @@
+from dataclasses import dataclass
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Resolves the async script as soon as extract() returns a value, watching DOM mutations and polling input values
+# (typing into an input changes its value property, which mutation observers don't see).
+# Selenium's script timeout rejects the call if no value ever appears.
+_WAIT_FOR_VALUES = """
+var done = arguments[arguments.length - 1];
+var args = Array.prototype.slice.call(arguments, 0, arguments.length - 1);
+var extract = function () { %s };
+var finished = false;
+var observer = null;
+var poller = null;
+var check = function () {
+    if (finished) { return; }
+    var value;
+    try { value = extract.apply(null, args); } catch (e) { value = null; }
+    if (value !== null && value !== undefined) {
+        finished = true;
+        if (observer) { observer.disconnect(); }
+        if (poller) { clearInterval(poller); }
+        done(value);
+    }
+};
+check();
+if (!finished) {
+    observer = new MutationObserver(check);
+    observer.observe(document, {subtree: true, childList: true, characterData: true, attributes: true});
+    poller = setInterval(check, 100);
+}
+"""
+
+# Google's converter: the second currency amount field holds the final crypto amount
+GOOGLE_CONVERSION_SCRIPT = _WAIT_FOR_VALUES % """
+    var inputs = document.querySelectorAll('input[aria-label="Currency Amount Field"]');
+    if (inputs.length < 2 || !inputs[1].value) { return null; }
+    return {amount: inputs[1].value};
+"""
+
+# CHANGENOW's swap form: the amount of initial crypto to send
+SWAP_AMOUNT_SCRIPT = _WAIT_FOR_VALUES % """
+    var field = document.getElementById('amount-field');
+    if (!field || !field.value) { return null; }
+    return {amount_from: field.value};
+"""
+
+# CHANGENOW's fiat form: the "1 LTC = x GBP" rate hint, parsed in the page
+FIAT_RATE_SCRIPT = _WAIT_FOR_VALUES % """
+    var fiat = arguments[0];
+    var hint = document.getElementsByClassName('new-stepper-hints__rate')[0];
+    if (!hint) { return null; }
+    var match = new RegExp('[=~]\\\\s*(\\\\d+\\\\.?\\\\d*)\\\\s*' + fiat).exec(hint.textContent);
+    if (!match) { return null; }
+    return {rate: match[1], text: hint.textContent};
+"""
+
+
+# Final crypto amount Google quotes for the item price
+@dataclass
+class GoogleConversionPayload:
+    amount: float
+
+
+# Initial crypto CHANGENOW asks for to deliver the final crypto amount
+@dataclass
+class SwapAmountPayload:
+    amount_from: float
+
+
+# Fiat value of one unit of initial crypto on CHANGENOW
+@dataclass
+class FiatRatePayload:
+    rate: float
+    text: str
+
+
+# Function to run one extraction script in a single WebDriver round-trip, bounded by the timeout
+def run_extraction(driver, script, timeout, *args):
+    driver.set_script_timeout(timeout)
+    return driver.execute_async_script(script, *args)
+
+
+def extract_google_conversion(driver, timeout):
+    payload = run_extraction(driver, GOOGLE_CONVERSION_SCRIPT, timeout)
+    return GoogleConversionPayload(float(payload['amount']))
+
+
+def extract_swap_amount(driver, timeout):
+    payload = run_extraction(driver, SWAP_AMOUNT_SCRIPT, timeout)
+    return SwapAmountPayload(float(payload['amount_from']))
+
+
+def extract_fiat_rate(driver, timeout, fiat_currency='gbp'):
+    payload = run_extraction(driver, FIAT_RATE_SCRIPT, timeout, fiat_currency.upper())
+    return FiatRatePayload(float(payload['rate']), payload['text'])
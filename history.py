@@ -0,0 +1,154 @@
+from datetime import datetime
+import logging
+import json
+import re
+import os
+from storage import update_json
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+READ_BLOCK_SIZE = 64 * 1024
+# What may come between the objects of a JSON array: whitespace, commas and the array's own brackets
+_SEPARATORS = re.compile(r'[\s,\[\]]*')
+_DECODER = json.JSONDecoder()
+# Quotes and braces, the bytes that matter when finding where objects start and end reading backwards
+_TOKENS_REVERSE = re.compile(rb'[{}"]')
+_BACKSLASHES = re.compile(rb'\\*')
+_OPEN, _CLOSE, _QUOTE = ord('{'), ord('}'), ord('"')
+
+
+# Function to yield the top-level objects of a JSON array file from first to last, reading it forwards in blocks,
+# so a whole history never has to be in memory. Each object is parsed by the JSON decoder where it starts; one cut
+# off by the end of the buffer is parsed again once the next block is in.
+def iter_entries(filename, block_size=READ_BLOCK_SIZE):
+    with open(filename, 'r', encoding='utf-8') as file:
+        buffer = ''
+        position = 0
+        at_end = False
+        while True:
+            position = _SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                if at_end:
+                    return
+                buffer, position = file.read(block_size), 0
+                at_end = not buffer
+                continue
+            try:
+                entry, position = _DECODER.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Malformed rather than cut off if the whole file is in and it still doesn't parse
+                if at_end:
+                    raise
+                block = file.read(block_size)
+                at_end = not block
+                buffer, position = buffer[position:] + block, 0
+                continue
+            yield entry
+
+
+# Function to yield the top-level objects of a JSON array file from last to first, reading it backwards in blocks.
+# A quote read backwards is escaped when an odd run of backslashes comes before it, so when that run reaches the
+# start of a block, the rest of the block is carried over and scanned together with the block before it.
+def iter_entries_reverse(filename, block_size=READ_BLOCK_SIZE):
+    with open(filename, 'rb') as file:
+        file.seek(0, 2)
+        position = file.tell()
+        depth = 0
+        in_string = False
+        # Pieces of the object being read, last piece first, when it spans several blocks
+        pieces = []
+        # Start of the last block, not scanned yet because a quote's escaping depends on the bytes before it
+        carry = b''
+        while position > 0 or carry:
+            size = min(block_size, position)
+            position -= size
+            file.seek(position)
+            block = file.read(size) + carry
+            carry = b''
+            reverse = block[::-1]
+            # Exclusive end of the current object's bytes within this block
+            end = len(block)
+            for token in _TOKENS_REVERSE.finditer(reverse):
+                index = len(block) - 1 - token.start()
+                char = block[index]
+                if in_string:
+                    if char != _QUOTE:
+                        continue
+                    backslashes = len(_BACKSLASHES.match(reverse, token.start() + 1).group())
+                    if backslashes == index and position > 0:
+                        carry = block[:index + 1]
+                        break
+                    if backslashes % 2 == 0:
+                        in_string = False
+                elif char == _QUOTE:
+                    in_string = True
+                elif char == _CLOSE:
+                    if depth == 0:
+                        end = index + 1
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        pieces.append(block[index:end])
+                        yield json.loads(b''.join(reversed(pieces)))
+                        pieces = []
+            if depth > 0:
+                pieces.append(block[len(carry):end])
+
+
+# Function to read only the entries newer than the cutoff, stopping at the first older one.
+# save_estimate() and sync_data() keep the file in time order, so nothing older can follow.
+def read_recent_entries(filename, cutoff):
+    recent_entries = []
+    invalid_entries = 0
+    cutoff_text = cutoff.strftime(DATE_FORMAT)
+    for entry in iter_entries_reverse(filename):
+        date_time = entry.get('date_time')
+        try:
+            datetime.strptime(date_time, DATE_FORMAT)
+        except (TypeError, ValueError):
+            invalid_entries += 1
+            continue
+        # The fixed-width date format compares correctly as text
+        if date_time < cutoff_text:
+            break
+        recent_entries.append(entry)
+    if invalid_entries:
+        logger.error(f"{invalid_entries} entries had an unparseable date_time.")
+    recent_entries.reverse()
+    return recent_entries
+
+
+# Function to order entries by time, keeping the original order for entries saved in the same second
+def sort_by_time(entries):
+    return sorted(entries, key=lambda entry: entry['date_time'])
+
+
+# Function to name the marker left next to a history file once it is known to be in time order
+def ordered_marker(filename):
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, f".{name}.ordered")
+
+
+# Function to sort a history file if it is out of time order, as histories saved before the file was kept sorted
+# can be, so read_recent_entries() can trust its early stop. Every writer keeps the file in order since, so this
+# is a one-off migration: once the file has been checked a marker is left and later calls return straight away.
+def ensure_time_ordered(filename):
+    marker = ordered_marker(filename)
+    if os.path.exists(marker):
+        return
+    previous = ''
+    try:
+        for entry in iter_entries(filename):
+            date_time = entry.get('date_time') or ''
+            if date_time < previous:
+                logger.warning(f"{filename} is not in time order at {date_time}, sorting it.")
+                update_json(filename, sort_by_time, [])
+                break
+            previous = date_time
+    except FileNotFoundError:
+        # Nothing to migrate yet; check the file once it exists
+        return
+    with open(marker, 'w'):
+        pass
@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+import argparse
+import tempfile
+import random
+import json
+import sys
+import os
+from history import DATE_FORMAT, iter_entries, iter_entries_reverse, read_recent_entries
+from storage import atomic_write_json_array
+from merging import MergeStats, UnsortedEntries, merge_sorted
+from compaction import compact_entries
+from checks import check
+
+# String values that trip up a reader counting braces: braces, quotes and backslashes in every arrangement
+TRICKY_NOTES = ['a } b', '{', '}}}', '{"date_time": "x"}', 'quote " inside', 'ends in a backslash \\',
+                '\\"{', '\\\\', '\\\\"}', 'tab\tnew\nline', 'pound £ and € signs', '']
+
+
+# Function to make time-ordered entries with nested legs and a note drawn from TRICKY_NOTES
+def make_entries(count, seed, start=datetime(2024, 3, 1, 10, 0)):
+    generator = random.Random(seed)
+    entries = []
+    for index in range(count):
+        entry = {
+            'date_time': (start + timedelta(seconds=97 * index)).strftime(DATE_FORMAT),
+            'final_estimate': round(generator.uniform(30.0, 60.0), 2),
+            'initial_product_price': 40.0,
+            'fiat_currency': 'gbp',
+            'initial_crypto': 'ltc',
+            'final_crypto': 'xmr',
+            'legs': {'xmr_trade_value': round(generator.uniform(0.1, 2.0), 6),
+                     'nested': {'note': generator.choice(TRICKY_NOTES)}},
+            'note': generator.choice(TRICKY_NOTES),
+        }
+        entries.append(entry)
+    return entries
+
+
+# Function to read a file with both readers at every block size given, returning the sizes each got wrong
+def reader_mismatches(filename, entries, block_sizes):
+    forward = [size for size in block_sizes if list(iter_entries(filename, size)) != entries]
+    backward = [size for size in block_sizes if list(iter_entries_reverse(filename, size)) != entries[::-1]]
+    return forward, backward
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the streaming history readers, the time-ordered merge and "
+                                                 "the compaction against plain in-memory results.")
+    parser.add_argument('--entries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    entries = make_entries(args.entries, args.seed)
+    # Small sizes put a block boundary at every position, including between a backslash and what it escapes
+    block_sizes = list(range(1, 34)) + [64, 1000, 64 * 1024]
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        layouts = {
+            'json.dump() compact': lambda file: json.dump(entries, file),
+            'json.dump() indented': lambda file: json.dump(entries, file, indent=4),
+            'json.dump() UTF-8': lambda file: json.dump(entries, file, ensure_ascii=False),
+        }
+        for name, write in layouts.items():
+            filename = os.path.join(directory, 'layout.json')
+            with open(filename, 'w', encoding='utf-8') as file:
+                write(file)
+            forward, backward = reader_mismatches(filename, entries, block_sizes)
+            results.append(check(f"both readers parse every entry of a {name} file at {len(block_sizes)} block "
+                                 f"sizes (forward wrong at {forward}, reverse wrong at {backward})",
+                                 not forward and not backward))
+
+        filename = os.path.join(directory, 'price_data.json')
+        atomic_write_json_array(filename, iter(entries))
+        forward, backward = reader_mismatches(filename, entries, block_sizes)
+        results.append(check("both readers parse what atomic_write_json_array() writes", not forward and not backward))
+
+        empty = os.path.join(directory, 'empty.json')
+        with open(empty, 'w') as file:
+            file.write('[]')
+        results.append(check("an empty array yields nothing either way",
+                             not list(iter_entries(empty)) and not list(iter_entries_reverse(empty))))
+
+        truncated = os.path.join(directory, 'truncated.json')
+        with open(truncated, 'w') as file:
+            file.write(json.dumps(entries[:3])[:-20])
+        try:
+            list(iter_entries(truncated))
+            raised = False
+        except json.JSONDecodeError:
+            raised = True
+        results.append(check("a file cut off mid-entry raises rather than losing the entry quietly", raised))
+
+        cutoff = datetime.strptime(entries[len(entries) // 2]['date_time'], DATE_FORMAT)
+        results.append(check("read_recent_entries() stops at the cutoff and keeps time order",
+                             read_recent_entries(filename, cutoff) == entries[len(entries) // 2:]))
+
+    # Two time-ordered inputs sharing a few entries merge into one ordered stream without repeats
+    shared = entries[::2]
+    local = entries[1::2] + entries[:10:2]
+    local.sort(key=lambda entry: entry['date_time'])
+    stats = MergeStats()
+    merged = list(merge_sorted([shared, local], stats))
+    results.append(check(f"merge_sorted() interleaves {len(shared)} shared and {len(local)} local entries in order, "
+                         f"dropping {stats.duplicates} repeats",
+                         merged == entries and stats.added == len(entries) - len(shared) and stats.duplicates == 5))
+
+    try:
+        list(merge_sorted([entries[::-1]]))
+        raised = False
+    except UnsortedEntries:
+        raised = True
+    results.append(check("merge_sorted() raises UnsortedEntries on input out of time order", raised))
+
+    # Eight raw entries in one old quarter-hour roll into one aggregate; recent ones pass through untouched
+    now = datetime(2024, 6, 1)
+    old = [dict(entry, date_time=f"2024-03-01 10:0{index}:00") for index, entry in enumerate(entries[:8])]
+    recent = [dict(entry, date_time=f"2024-05-31 12:0{index}:00") for index, entry in enumerate(entries[8:11])]
+    compacted = list(compact_entries(old + recent, retention_days=30, now=now))
+    aggregate = compacted[0]
+    mean = sum(entry['final_estimate'] for entry in old) / len(old)
+    results.append(check("compact_entries() rolls an old quarter-hour into one aggregate and keeps recent entries",
+                         len(compacted) == 4 and aggregate.get('aggregate') and aggregate['count'] == 8
+                         and abs(aggregate['final_estimate'] - mean) < 1e-9 and compacted[1:] == recent))
+
+    # Merging the raw entries back in, as a sync against an older copy does, must not count them twice
+    remerged = list(compact_entries(merge_sorted([old, compacted]), retention_days=30, now=now))
+    results.append(check("re-compacting the aggregate with its raw entries keeps a single aggregate of 8",
+                         remerged == compacted))
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
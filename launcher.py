@@ -1,9 +1,12 @@
 import os
 import subprocess
 import sys
+import atexit
 import requests
 import zipfile
 import shutil
+from storage import read_json
+from metrics import metrics, METRICS_FILE, PROMETHEUS_FILE
 
 
 # Function to get the latest version tag from GitHub API
@@ -91,12 +94,19 @@ def main():
     latest_version_url = f"https://api.github.com/repos/{owner}/{repo}/releases/latest"
     updater_path = os.path.join(app_dir, "GF_Updater.exe")
 
+    # Add the update check's timing to the metrics the app keeps across runs, exported where the app exports them
+    metrics.increment('getfees_runs_total', program='launcher')
+    textfile = read_json('settings.json', {}).get('metrics_textfile', PROMETHEUS_FILE)
+    atexit.register(metrics.save, METRICS_FILE, textfile)
+
     try:
         # Get the current and latest version
-        current_version_raw = subprocess.run([app_exe_path, "--version"], capture_output=True, text=True).stdout.strip()
-        current_version = normalize_version(current_version_raw)
-        latest_version_raw = get_latest_version(latest_version_url)
-        latest_version = normalize_version(latest_version_raw)
+        with metrics.timed('launcher_update_check'):
+            current_version_raw = subprocess.run([app_exe_path, "--version"], capture_output=True,
+                                                 text=True).stdout.strip()
+            current_version = normalize_version(current_version_raw)
+            latest_version_raw = get_latest_version(latest_version_url)
+            latest_version = normalize_version(latest_version_raw)
 
         if current_version != latest_version:
             # Fetch the latest release information, including the release description
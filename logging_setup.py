@@ -0,0 +1,55 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import logging
+import os
+import queue
+
+LOG_FILE = 'GetFees.log'
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+# Rotate once a log reaches 1MB and keep five older logs (previous runs included)
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+_listener = None
+
+
+# Function to route all logging through a queue so only a background thread touches the log file
+def configure_logging(filename=LOG_FILE, level=logging.DEBUG, max_bytes=LOG_MAX_BYTES,
+                      backup_count=LOG_BACKUP_COUNT):
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    # Start every run in a fresh file, keeping the previous run as GetFees.log.1
+    if os.path.getsize(filename) > 0:
+        try:
+            file_handler.doRollover()
+        except OSError:
+            # Windows refuses to rename a log another running instance has open, so append to it instead
+            if file_handler.stream is None:
+                file_handler.stream = file_handler._open()
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    # Flush whatever is still queued when the program exits
+    atexit.register(_listener.stop)
+    return _listener
+
+
+# Function to apply per-module levels from the settings file, e.g. {"providers": "INFO"}
+def set_module_levels(module_levels):
+    for module_name, level_name in (module_levels or {}).items():
+        level = logging.getLevelName(str(level_name).upper())
+        if isinstance(level, int):
+            logging.getLogger(module_name).setLevel(level)
+        else:
+            logging.getLogger(__name__).warning(f"Unknown log level '{level_name}' for '{module_name}' ignored.")
@@ -0,0 +1,78 @@
+from dataclasses import dataclass, field
+import heapq
+import logging
+from outbox import entry_id
+
+logger = logging.getLogger(__name__)
+
+
+# Raised when a merge input turns out not to be in time order, so it has to be sorted before merging
+class UnsortedEntries(Exception):
+    pass
+
+
+# Order-independent fingerprint of a set of entries, so two datasets can be compared without holding either
+@dataclass
+class EntryDigest:
+    count: int = 0
+    total: int = 0
+
+    def add(self, entry):
+        self.count += 1
+        self.total = (self.total + int(entry_id(entry), 16)) % 2 ** 64
+
+    @classmethod
+    def of(cls, entries):
+        digest = cls()
+        for entry in entries:
+            digest.add(entry)
+        return digest
+
+    # Function to pass entries through while adding them to the digest
+    def track(self, entries):
+        for entry in entries:
+            self.add(entry)
+            yield entry
+
+
+# What a merge did: entries taken from the other inputs that the base did not have, and repeats dropped
+@dataclass
+class MergeStats:
+    added: int = 0
+    duplicates: int = 0
+    base_digest: EntryDigest = field(default_factory=EntryDigest)
+
+
+def _in_time_order(entries, index):
+    previous = ''
+    for entry in entries:
+        if entry['date_time'] < previous:
+            raise UnsortedEntries(f"Merge input {index} is not in time order at {entry['date_time']}.")
+        previous = entry['date_time']
+        yield index, entry
+
+
+# Function to merge time-ordered iterables of entries into one time-ordered stream, dropping entries with an id
+# already seen. The first input is the base: its entries win ties and only entries from the others count as added.
+# Duplicates share a date_time, so only the ids of the current second are remembered and memory stays bounded
+# however long the inputs are.
+def merge_sorted(sources, stats=None):
+    stats = stats if stats is not None else MergeStats()
+    streams = [_in_time_order(entries, index) for index, entries in enumerate(sources)]
+    current_time = None
+    seen_ids = set()
+    for index, entry in heapq.merge(*streams, key=lambda item: (item[1]['date_time'], item[0])):
+        if index == 0:
+            stats.base_digest.add(entry)
+        if entry['date_time'] != current_time:
+            current_time = entry['date_time']
+            seen_ids.clear()
+        identifier = entry_id(entry)
+        if identifier in seen_ids:
+            stats.duplicates += 1
+            continue
+        seen_ids.add(identifier)
+        if index != 0:
+            stats.added += 1
+        yield entry
+    logger.info(f"Merged {stats.added} new entries, skipped {stats.duplicates} duplicates.")
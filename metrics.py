@@ -0,0 +1,140 @@
+from contextlib import contextmanager
+import threading
+import logging
+import time
+from storage import LockTimeout, update_json, atomic_write
+
+logger = logging.getLogger(__name__)
+
+METRICS_FILE = 'metrics.json'
+PROMETHEUS_FILE = 'GetFees.prom'
+# Upper bounds in seconds of the latency histogram buckets, from a quick parse to a slow page load or sync
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+METRIC_HELP = {
+    'getfees_stage_duration_seconds': "Time spent in each stage of the collector and quote pipeline.",
+    'getfees_stage_failures_total': "Stage runs that ended in an error, retried attempts included.",
+    'getfees_upload_conflicts_total': "Uploads refused because another client updated the shared data first.",
+    'getfees_runs_total': "Runs of each program that saved metrics.",
+    'getfees_last_save_timestamp_seconds': "Unix time metrics were last saved.",
+}
+
+
+# Function to render labels the way Prometheus writes them, which also serves as the key of a series
+def format_labels(labels):
+    escaped = {name: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for name, value in labels.items()}
+    return ','.join(f'{name}="{value}"' for name, value in sorted(escaped.items()))
+
+
+# Function to write a series name with its labels, leaving out the braces when there are none
+def series_name(name, key):
+    return f"{name}{{{key}}}" if key else name
+
+
+# Counters and latency histograms for one run, added onto the totals in METRICS_FILE when saved
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = format_labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = format_labels(labels)
+        bucket = next((index for index, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.setdefault(key, {'bounds': self.buckets, 'counts': [0] * (len(self.buckets) + 1),
+                                                'sum': 0.0, 'count': 0})
+            histogram['counts'][bucket] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    # Function to count a failed stage, for stages that report failure by returning rather than raising
+    def record_failure(self, stage):
+        self.increment('getfees_stage_failures_total', stage=stage)
+
+    # Time the enclosed block as a stage, counting it as failed if it raises
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record_failure(stage)
+            raise
+        finally:
+            self.observe('getfees_stage_duration_seconds', time.perf_counter() - start, stage=stage)
+
+    def _take(self):
+        with self._lock:
+            counters, histograms = self.counters, self.histograms
+            self.counters, self.histograms = {}, {}
+        return counters, histograms
+
+    # Function to add this run's metrics onto the saved totals and, if given a path, export them as a
+    # Prometheus textfile. Several programs may save into the same file, so the totals are merged under its lock.
+    def save(self, filename=METRICS_FILE, textfile=None):
+        counters, histograms = self._take()
+
+        def add_run(totals):
+            for name, series in counters.items():
+                saved_series = totals['counters'].setdefault(name, {})
+                for key, value in series.items():
+                    saved_series[key] = saved_series.get(key, 0) + value
+            for name, series in histograms.items():
+                saved_series = totals['histograms'].setdefault(name, {})
+                for key, histogram in series.items():
+                    saved = saved_series.get(key)
+                    if saved is None or saved['bounds'] != histogram['bounds']:
+                        # Buckets changed between versions; older counts no longer line up, so start over
+                        saved_series[key] = histogram
+                        continue
+                    saved['counts'] = [total + count for total, count in zip(saved['counts'], histogram['counts'])]
+                    saved['sum'] += histogram['sum']
+                    saved['count'] += histogram['count']
+            totals['updated'] = time.time()
+            return totals
+
+        try:
+            totals = update_json(filename, add_run, {'counters': {}, 'histograms': {}})
+            if textfile:
+                atomic_write(textfile, lambda file: file.write(prometheus_text(totals)))
+        except (OSError, LockTimeout) as e:
+            logger.warning(f"Metrics not saved: {e}")
+
+
+# Function to render saved totals in the Prometheus text exposition format, for node_exporter's textfile collector
+def prometheus_text(totals):
+    lines = []
+
+    def header(name, metric_type):
+        lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} {metric_type}")
+
+    for name, series in sorted(totals['counters'].items()):
+        header(name, 'counter')
+        for key, value in sorted(series.items()):
+            lines.append(f"{series_name(name, key)} {value}")
+    for name, series in sorted(totals['histograms'].items()):
+        header(name, 'histogram')
+        for key, histogram in sorted(series.items()):
+            separator = ',' if key else ''
+            cumulative = 0
+            for bound, count in zip(histogram['bounds'] + ['+Inf'], histogram['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{key}{separator}le="{bound}"}} {cumulative}')
+            lines.append(f"{series_name(name + '_sum', key)} {histogram['sum']}")
+            lines.append(f"{series_name(name + '_count', key)} {histogram['count']}")
+    header('getfees_last_save_timestamp_seconds', 'gauge')
+    lines.append(f"getfees_last_save_timestamp_seconds {totals['updated']}")
+    return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
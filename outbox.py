@@ -0,0 +1,56 @@
+import threading
+import hashlib
+import logging
+import json
+from scheduler import QuoteBudget, RetryPolicy, run_step, BudgetExceeded, StepFailed
+from storage import read_json, update_json
+
+logger = logging.getLogger(__name__)
+
+outbox_file = 'outbox.json'
+# Backoff used when the background flush cannot reach GitHub; whatever is left waits for the next run
+FLUSH_POLICY = RetryPolicy(max_attempts=5, attempt_timeout=60.0, base_delay=2.0, max_delay=30.0,
+                           retry_on=(ConnectionError, OSError))
+FLUSH_BUDGET = 180.0
+
+# Function to build the key that identifies an estimate entry, the six fields merges dedupe on
+def entry_key(entry):
+    return (entry['initial_product_price'], entry['final_estimate'], entry['date_time'],
+            entry['fiat_currency'], entry['initial_crypto'], entry['final_crypto'])
+
+
+# Function to give an entry a short id derived from entry_key(), the same in every process and run
+def entry_id(entry):
+    return hashlib.blake2b(json.dumps(entry_key(entry)).encode('utf-8'), digest_size=8).hexdigest()
+
+
+# Function to read the entries that have not reached the shared dataset yet
+def load_outbox(filename=outbox_file):
+    return read_json(filename, [])
+
+
+# Function to queue a new entry for upload
+def add_to_outbox(entry, filename=outbox_file):
+    update_json(filename, lambda pending: pending + [entry], [])
+
+
+# Function to drop entries once they are in the shared dataset, keeping any queued since the flush began
+def remove_from_outbox(entries, filename=outbox_file):
+    flushed_keys = {entry_key(entry) for entry in entries}
+    remaining = update_json(filename, lambda pending: [entry for entry in pending
+                                                       if entry_key(entry) not in flushed_keys], [])
+    logger.info(f"{len(entries)} entries flushed from the outbox, {len(remaining)} still pending.")
+
+
+# Function to flush the outbox on a background thread; flush_func uploads every pending entry in one go
+# and raises a retryable error when it cannot
+def start_background_flush(flush_func, policy=FLUSH_POLICY, budget_seconds=FLUSH_BUDGET):
+    def flush():
+        try:
+            run_step('flush outbox', flush_func, QuoteBudget(budget_seconds), policy)
+        except (BudgetExceeded, StepFailed) as e:
+            logger.warning(f"Outbox not flushed, entries kept for the next run: {e}")
+
+    thread = threading.Thread(target=flush, name='outbox-flush', daemon=True)
+    thread.start()
+    return thread
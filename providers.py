@@ -0,0 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+import time
+import os
+import logging
+import requests
+from tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Default time allowed for all providers to answer before slow ones are dropped
+DEFAULT_QUOTE_DEADLINE = 20.0
+
+
+# Single quote from one provider: how much initial crypto is needed to receive amount_to of the final crypto
+@dataclass
+class Quote:
+    provider: str
+    from_currency: str
+    to_currency: str
+    amount_to: float
+    amount_from: float = None
+    elapsed: float = 0.0
+    error: str = None
+
+    # A quote is only usable if the provider answered with a positive amount and no error
+    @property
+    def complete(self):
+        return self.error is None and self.amount_from is not None and self.amount_from > 0
+
+
+# Result of querying every provider for the same pair and amount
+@dataclass
+class QuoteComparison:
+    best: Quote = None
+    quotes: list = field(default_factory=list)
+
+
+# Base class for an exchange backend able to quote a reverse (fixed output) swap
+class QuoteProvider:
+    name = 'provider'
+    # Providers that drive the shared browser run on the calling thread, as a WebDriver session is not thread-safe
+    inline = False
+
+    # Return the amount of from_currency needed to receive amount_to of to_currency before the deadline
+    # (deadline is a time.monotonic() timestamp)
+    def quote(self, from_currency, to_currency, amount_to, deadline):
+        raise NotImplementedError
+
+
+# Provider wrapping a plain function, used for the browser based CHANGENOW scrape and local stand-ins
+class CallableProvider(QuoteProvider):
+    def __init__(self, name, quote_func, inline=False):
+        self.name = name
+        self.quote_func = quote_func
+        self.inline = inline
+
+    def quote(self, from_currency, to_currency, amount_to, deadline):
+        return self.quote_func(from_currency, to_currency, amount_to, deadline)
+
+
+# Provider backed by a public JSON rate endpoint
+class HttpQuoteProvider(QuoteProvider):
+    def __init__(self, name, url_template, amount_path, headers=None, upper_case=False):
+        self.name = name
+        self.url_template = url_template
+        self.amount_path = amount_path
+        self.headers = headers or {}
+        self.upper_case = upper_case
+
+    def quote(self, from_currency, to_currency, amount_to, deadline):
+        if self.upper_case:
+            from_currency, to_currency = from_currency.upper(), to_currency.upper()
+        url = self.url_template.format(from_currency=from_currency, to_currency=to_currency, amount_to=amount_to)
+        # Never let the request outlive the shared deadline
+        timeout = max(deadline - time.monotonic(), 0.1)
+        response = requests.get(url, headers=self.headers, timeout=timeout)
+        response.raise_for_status()
+        value = response.json()
+        for key in self.amount_path:
+            value = value[key]
+        return float(value)
+
+
+# Function to build the HTTP providers named in the settings file
+def build_providers(provider_names):
+    available = {
+        'exolix': lambda: HttpQuoteProvider(
+            'exolix',
+            'https://exolix.com/api/v2/rate?coinFrom={from_currency}&coinTo={to_currency}'
+            '&withdrawalAmount={amount_to}&rateType=float',
+            ['fromAmount'], upper_case=True),
+        'changenow_api': lambda: HttpQuoteProvider(
+            'changenow_api',
+            'https://api.changenow.io/v2/exchange/estimated-amount?fromCurrency={from_currency}'
+            '&toCurrency={to_currency}&toAmount={amount_to}&type=reverse&flow=fixed-rate',
+            ['fromAmount'], headers={'x-changenow-api-key': os.getenv('CHANGENOW_API_KEY', '')}),
+    }
+    providers = []
+    for provider_name in provider_names:
+        if provider_name in available:
+            providers.append(available[provider_name]())
+        else:
+            logger.warning(f"Unknown quote provider '{provider_name}' ignored.")
+    return providers
+
+
+# Function to run one provider and capture its result, error and latency in a Quote
+def _timed_quote(provider, from_currency, to_currency, amount_to, deadline):
+    quote = Quote(provider.name, from_currency, to_currency, amount_to)
+    start = time.monotonic()
+    try:
+        with tracer.span(f"quote {provider.name}", pair=f"{from_currency}/{to_currency}"):
+            quote.amount_from = provider.quote(from_currency, to_currency, amount_to, deadline)
+    except Exception as e:
+        quote.error = str(e) or type(e).__name__
+    quote.elapsed = time.monotonic() - start
+    return quote
+
+
+# Function to query every provider concurrently and return the cheapest complete quote.
+# Inline providers run one after another on the calling thread while the others answer in the background,
+# so they have finished with the browser by the time this returns.
+def compare_quotes(providers, from_currency, to_currency, amount_to, deadline_seconds=DEFAULT_QUOTE_DEADLINE):
+    comparison = QuoteComparison()
+    if not providers:
+        return comparison
+    deadline = time.monotonic() + deadline_seconds
+    background = [provider for provider in providers if not provider.inline]
+    executor = ThreadPoolExecutor(max_workers=max(len(background), 1))
+    futures = {provider: executor.submit(_timed_quote, provider, from_currency, to_currency, amount_to, deadline)
+               for provider in background}
+    inline_quotes = {provider: _timed_quote(provider, from_currency, to_currency, amount_to, deadline)
+                     for provider in providers if provider.inline}
+    done, not_done = wait(futures.values(), timeout=max(deadline - time.monotonic(), 0.0))
+    # Slow providers are dropped rather than blocking the result
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    for provider in providers:
+        future = futures.get(provider)
+        if future is None:
+            quote = inline_quotes[provider]
+        elif future in done:
+            quote = future.result()
+        else:
+            future.cancel()
+            quote = Quote(provider.name, from_currency, to_currency, amount_to, elapsed=deadline_seconds,
+                          error=f"No answer within {deadline_seconds}s deadline")
+        comparison.quotes.append(quote)
+        if quote.complete:
+            logger.debug(f"Provider {quote.provider} quoted {quote.amount_from}{from_currency.upper()} "
+                         f"in {quote.elapsed:.2f}s.")
+            if comparison.best is None or quote.amount_from < comparison.best.amount_from:
+                comparison.best = quote
+        else:
+            logger.warning(f"Provider {quote.provider} failed to quote: {quote.error}")
+
+    return comparison
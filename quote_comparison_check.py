@@ -0,0 +1,117 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import threading
+import argparse
+import json
+import time
+import sys
+from providers import CallableProvider, HttpQuoteProvider, compare_quotes
+from checks import check
+
+RATE_PATH = '/rate'
+
+
+# Threaded stand-in for an exchange's rate endpoint. Each stand-in provider is named in the query and answers
+# after its own latency with amount_to * price, or with the HTTP status it is set to fail with.
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, providers):
+        # providers: name -> {'price': float, 'latency': seconds, 'status': HTTP status}
+        self.providers = providers
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        provider = self.server.providers.get(query.get('provider'))
+        if url.path != RATE_PATH or provider is None:
+            self._reply(404, {'message': 'Not Found'})
+            return
+        time.sleep(provider['latency'])
+        if provider.get('status', 200) != 200:
+            self._reply(provider['status'], {'message': 'Stand-in failure'})
+            return
+        self._reply(200, {'fromAmount': float(query['amount_to']) * provider['price']})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up at its deadline
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def http_provider(server, name):
+    return HttpQuoteProvider(name, f"http://127.0.0.1:{server.server_address[1]}{RATE_PATH}?provider={name}"
+                                   "&from={from_currency}&to={to_currency}&amount_to={amount_to}", ['fromAmount'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Race quote providers against local stand-ins and check the "
+                                                 "cheapest quote is chosen within the deadline.")
+    parser.add_argument('--latency', type=float, default=0.2, help="seconds the normal stand-ins take to answer")
+    parser.add_argument('--slow-latency', type=float, default=3.0, help="seconds the slow stand-in takes to answer")
+    parser.add_argument('--deadline', type=float, default=1.0, help="seconds allowed for all providers")
+    args = parser.parse_args()
+
+    server = StandInServer({
+        'cheap': {'price': 1.5, 'latency': args.latency},
+        'dear': {'price': 1.8, 'latency': args.latency},
+        # Cheapest of all, but answers after the deadline
+        'slow': {'price': 1.2, 'latency': args.slow_latency},
+        'broken': {'price': 1.0, 'latency': args.latency, 'status': 500},
+    })
+    threading.Thread(target=server.serve_forever, name='stand-in-rates', daemon=True).start()
+
+    # Stand-in for the browser provider, which must run on the calling thread
+    inline_threads = []
+
+    def browser_quote(from_currency, to_currency, amount_to, deadline):
+        inline_threads.append(threading.current_thread())
+        time.sleep(args.latency)
+        return amount_to * 1.6
+
+    providers = [CallableProvider('browser', browser_quote, inline=True)]
+    providers += [http_provider(server, name) for name in ('cheap', 'dear', 'slow', 'broken')]
+
+    started = time.monotonic()
+    comparison = compare_quotes(providers, 'ltc', 'xmr', 2.0, args.deadline)
+    elapsed = time.monotonic() - started
+    server.shutdown()
+
+    quotes = {quote.provider: quote for quote in comparison.quotes}
+    for quote in comparison.quotes:
+        print(f"     {quote.provider}: amount_from={quote.amount_from} elapsed={quote.elapsed:.2f}s "
+              f"error={quote.error}")
+    results = [
+        check("every provider has a quote entry, in the order given",
+              [quote.provider for quote in comparison.quotes] == [provider.name for provider in providers]),
+        check("the cheapest quote answering in time is chosen",
+              comparison.best is not None and comparison.best.provider == 'cheap'
+              and abs(comparison.best.amount_from - 3.0) < 1e-9),
+        check("the slow provider is dropped at the deadline",
+              quotes['slow'].amount_from is None and 'deadline' in (quotes['slow'].error or '')),
+        check("the comparison returns at the deadline rather than waiting for the slow provider",
+              elapsed < min(args.deadline + 0.5, args.slow_latency)),
+        check("the failing provider's error is recorded", quotes['broken'].error is not None
+              and not quotes['broken'].complete),
+        check("the browser provider ran on the calling thread and was counted",
+              inline_threads == [threading.main_thread()] and quotes['browser'].complete),
+    ]
+    print(f"Compared {len(providers)} providers in {elapsed:.2f}s")
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
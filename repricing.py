@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import product
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+# Scraped legs of every repriceable entry, one array element per entry
+@dataclass
+class LegArrays:
+    entries: list
+    xmr_trade_value: np.ndarray
+    xmr_to_ltc_rate: np.ndarray
+    one_ltc_to_gbp_value: np.ndarray
+    item_price: np.ndarray
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Fee, balance and item price combinations to reprice the history under, one array element per scenario
+@dataclass
+class Scenarios:
+    xmr_fees: np.ndarray
+    balances: np.ndarray
+    item_prices: np.ndarray = None
+
+    def __len__(self):
+        return len(self.xmr_fees)
+
+
+# Function to build every combination of the given fees, balances and (optionally) item prices
+def scenario_grid(xmr_fees, balances=(0.0,), item_prices=None):
+    if item_prices is None:
+        combinations = np.array(list(product(xmr_fees, balances)), dtype=float).reshape(-1, 2)
+        return Scenarios(combinations[:, 0], combinations[:, 1])
+    combinations = np.array(list(product(xmr_fees, balances, item_prices)), dtype=float).reshape(-1, 3)
+    return Scenarios(combinations[:, 0], combinations[:, 1], combinations[:, 2])
+
+
+# Function to collect the legs of entries that stored them; older entries only kept their final estimate
+def collect_legs(entries):
+    entries = [entry for entry in entries if entry.get('legs')]
+    return LegArrays(
+        entries,
+        np.array([entry['legs']['xmr_trade_value'] for entry in entries], dtype=float),
+        np.array([entry['legs']['xmr_to_ltc_rate'] for entry in entries], dtype=float),
+        np.array([entry['legs']['one_ltc_to_gbp_value'] for entry in entries], dtype=float),
+        np.array([entry['initial_product_price'] for entry in entries], dtype=float),
+    )
+
+
+# Function to recompute calculate_final_price() for every scenario and entry at once, returning a
+# scenarios x entries array. A scenario item price scales the entry's swap amount, as the swap is quoted
+# for the item price converted to the final crypto.
+def reprice(legs, scenarios):
+    gross = legs.one_ltc_to_gbp_value * legs.xmr_to_ltc_rate
+    if scenarios.item_prices is not None:
+        gross = gross * (scenarios.item_prices[:, None] / legs.item_price)
+    else:
+        gross = np.broadcast_to(gross, (len(scenarios), len(legs)))
+    return np.round(np.round(gross, 2) + scenarios.xmr_fees[:, None] - scenarios.balances[:, None], 2)
+
+
+# Function to return copies of the entries with final_estimate recomputed under the given fees, so history
+# saved under older fee settings stays comparable. Entries without legs are returned unchanged.
+# Compacted aggregates keep no legs, but the fees are a flat addition to every estimate they average, so an
+# aggregate whose entries all stored their fees is shifted by the difference in fees instead.
+def reprice_entries(entries, xmr_fees):
+    legs = collect_legs(entries)
+    repriced = {}
+    if len(legs):
+        estimates = reprice(legs, Scenarios(np.array([xmr_fees], dtype=float), np.zeros(1)))[0]
+        repriced = {id(entry): float(estimate) for entry, estimate in zip(legs.entries, estimates)}
+    for entry in entries:
+        if entry.get('aggregate') and entry.get('xmr_fees') is not None:
+            repriced[id(entry)] = round(entry['final_estimate'] - entry['xmr_fees'] + xmr_fees, 2)
+    if not repriced:
+        return entries
+    logger.info(f"Repriced {len(repriced)} of {len(entries)} entries with fees £{xmr_fees}.")
+    return [dict(entry, final_estimate=repriced[id(entry)]) if id(entry) in repriced else entry
+            for entry in entries]
+
+
+# Function to find the quarter-hour with the lowest average estimate for every scenario at once.
+# Returns the quarter-hour start times and, per scenario, the index of the best one and its average.
+def best_quarter_hours(legs, estimates):
+    times = [datetime.strptime(entry['date_time'], DATE_FORMAT) for entry in legs.entries]
+    quarter_hours = np.array([time.replace(minute=(time.minute // 15) * 15, second=0) for time in times],
+                             dtype='datetime64[s]')
+    order = np.argsort(quarter_hours, kind='stable')
+    unique_quarters, starts, counts = np.unique(quarter_hours[order], return_index=True, return_counts=True)
+    averages = np.add.reduceat(estimates[:, order], starts, axis=1) / counts
+    best = averages.argmin(axis=1)
+    return unique_quarters, best, averages[np.arange(len(best)), best]
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+import argparse
+import random
+import sys
+import numpy as np
+from history import DATE_FORMAT
+from compaction import compact_entries
+from repricing import collect_legs, scenario_grid, reprice, reprice_entries, best_quarter_hours
+from checks import check
+import selenium_fees
+
+
+# Function to make entries with random legs, saved the way main() saves them (estimate plus balance)
+def random_entries(count, xmr_fees, seed):
+    generator = random.Random(seed)
+    start = datetime(2024, 10, 1)
+    entries = []
+    for index in range(count):
+        legs = {'xmr_trade_value': round(generator.uniform(0.1, 2.0), 6),
+                'xmr_to_ltc_rate': round(generator.uniform(0.2, 3.0), 8),
+                'one_ltc_to_gbp_value': round(generator.uniform(40.0, 120.0), 2)}
+        balance = round(generator.uniform(0.0, 5.0), 2)
+        estimate = selenium_fees.calculate_final_price(legs['one_ltc_to_gbp_value'], legs['xmr_to_ltc_rate'], balance,
+                                                       xmr_fees)
+        entries.append({
+            'date_time': (start + timedelta(minutes=7 * index)).strftime(DATE_FORMAT),
+            'final_estimate': estimate + balance,
+            'initial_product_price': round(generator.uniform(10.0, 200.0), 2),
+            'fiat_currency': 'gbp',
+            'initial_crypto': 'ltc',
+            'final_crypto': 'xmr',
+            'legs': legs,
+            'xmr_fees': xmr_fees,
+        })
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the vectorised repricing against calculate_final_price().")
+    parser.add_argument('--entries', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    entries = random_entries(args.entries, 0.5, args.seed)
+    legs = collect_legs(entries)
+    scenarios = scenario_grid([0.0, 0.35, 0.5, 1.25], [0.0, 2.5], [15.0, 80.0])
+    estimates = reprice(legs, scenarios)
+
+    # Every scenario and entry against the scalar calculation, the item price scaling the swap amount
+    mismatches = 0
+    for row in range(len(scenarios)):
+        for column, entry in enumerate(legs.entries):
+            scale = scenarios.item_prices[row] / entry['initial_product_price']
+            expected = selenium_fees.calculate_final_price(entry['legs']['one_ltc_to_gbp_value'],
+                                                           entry['legs']['xmr_to_ltc_rate'] * scale,
+                                                           scenarios.balances[row], scenarios.xmr_fees[row])
+            mismatches += abs(estimates[row, column] - expected) > 0.0051
+    results = [check(f"reprice() matches calculate_final_price() for {len(scenarios)} scenarios x {len(legs)} "
+                     f"entries to the penny ({mismatches} mismatches)", mismatches == 0)]
+
+    repriced = reprice_entries(entries, 1.25)
+    expected = [selenium_fees.calculate_final_price(entry['legs']['one_ltc_to_gbp_value'],
+                                                    entry['legs']['xmr_to_ltc_rate'], 0.0, 1.25) for entry in entries]
+    results.append(check("reprice_entries() matches calculate_final_price() under new fees",
+                         all(abs(entry['final_estimate'] - value) <= 0.0051
+                             for entry, value in zip(repriced, expected))))
+
+    # Best quarter-hour per scenario against a plain grouping of the same estimates
+    quarters, best, averages = best_quarter_hours(legs, estimates)
+    agreed = True
+    for row in range(len(scenarios)):
+        groups = {}
+        for column, entry in enumerate(legs.entries):
+            moment = datetime.strptime(entry['date_time'], DATE_FORMAT)
+            groups.setdefault(moment.replace(minute=moment.minute // 15 * 15, second=0), []).append(
+                estimates[row, column])
+        group_averages = {quarter: sum(values) / len(values) for quarter, values in groups.items()}
+        plain_best = min(group_averages, key=group_averages.get)
+        agreed &= (quarters[best[row]].astype(datetime) == plain_best
+                   and np.isclose(averages[row], group_averages[plain_best]))
+    results.append(check("best_quarter_hours() agrees with a plain per quarter-hour average", agreed))
+
+    # Compacted aggregates keep their mean fees, so repricing them shifts each by the change in fees
+    aggregates = list(compact_entries(entries, retention_days=0, now=datetime(2030, 1, 1)))
+    repriced_aggregates = reprice_entries(aggregates, 1.25)
+    shifted = all(abs(entry['final_estimate'] - (aggregate['final_estimate'] + 0.75)) <= 0.0051
+                  for entry, aggregate in zip(repriced_aggregates, aggregates))
+    results.append(check(f"{len(aggregates)} compacted aggregates reprice by the change in fees", shifted))
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+import math
+import logging
+import requests
+from providers import compare_quotes, DEFAULT_QUOTE_DEADLINE
+from storage import read_json, update_json
+
+logger = logging.getLogger(__name__)
+
+rate_cache_file = 'rate_cache.json'
+# Market prices for every candidate coin in one request, used to price the fiat leg of routes not yet scraped
+FIAT_PRICE_URL = 'https://api.coingecko.com/api/v3/simple/price?ids={ids}&vs_currencies={fiat_currency}'
+COIN_IDS = {'btc': 'bitcoin', 'eth': 'ethereum', 'ltc': 'litecoin', 'usdt': 'tether', 'usdc': 'usd-coin',
+            'xmr': 'monero', 'bch': 'bitcoin-cash', 'doge': 'dogecoin', 'sol': 'solana', 'trx': 'tron'}
+
+
+# One conversion hop: price is how much from_currency buys a single unit of to_currency,
+# fee is a fixed fiat cost charged whenever the hop is used
+@dataclass
+class RateEdge:
+    from_currency: str
+    to_currency: str
+    price: float
+    fee: float = 0.0
+    source: str = None
+
+    # Shortest path weight, the negative log of the rate (1 / price)
+    @property
+    def weight(self):
+        return math.log(self.price)
+
+
+# Cheapest way found to receive an amount of the target currency
+@dataclass
+class Route:
+    edges: list = field(default_factory=list)
+    amount_in: float = 0.0
+    fees: float = 0.0
+
+    @property
+    def path(self):
+        return [self.edges[0].from_currency] + [edge.to_currency for edge in self.edges] if self.edges else []
+
+    @property
+    def total(self):
+        return self.amount_in + self.fees
+
+
+# Directed graph of currency pair prices, keeping only the cheapest edge per pair
+class RateGraph:
+    def __init__(self):
+        self.edges = {}
+
+    def add_rate(self, from_currency, to_currency, price, fee=0.0, source=None):
+        if not price or price <= 0:
+            return
+        current = self.edges.setdefault(from_currency, {}).get(to_currency)
+        if current is None or (price, fee) < (current.price, current.fee):
+            self.edges[from_currency][to_currency] = RateEdge(from_currency, to_currency, price, fee, source)
+
+    def neighbours(self, currency):
+        return self.edges.get(currency, {}).values()
+
+
+# Function to find the cheapest route from source to target for a given target amount
+def cheapest_route(graph, source, target, amount_to, max_hops=3):
+    # Labels are (sum of negative log rates, sum of hop fees, edges) per currency; a label is only kept while no
+    # other label at the same currency is at least as good on both the rate product and the fixed fees
+    labels = {source: [(0.0, 0.0, [])]}
+    frontier = labels[source]
+    for _ in range(max_hops):
+        next_frontier = []
+        for weight, fees, edges in frontier:
+            current = edges[-1].to_currency if edges else source
+            visited = {source} | {edge.to_currency for edge in edges}
+            for edge in graph.neighbours(current):
+                if edge.to_currency in visited:
+                    continue
+                label = (weight + edge.weight, fees + edge.fee, edges + [edge])
+                existing = labels.setdefault(edge.to_currency, [])
+                if any(other[0] <= label[0] and other[1] <= label[1] for other in existing):
+                    continue
+                existing[:] = [other for other in existing if not (label[0] <= other[0] and label[1] <= other[1])]
+                existing.append(label)
+                next_frontier.append(label)
+        frontier = next_frontier
+        if not frontier:
+            break
+
+    best = None
+    for _, fees, edges in labels.get(target, []):
+        # Multiply prices back from the target so the amount is exact rather than exp(sum of logs)
+        amount_in = amount_to
+        for edge in reversed(edges):
+            amount_in *= edge.price
+        route = Route(edges, amount_in, fees)
+        if best is None or route.total < best.total:
+            best = route
+    return best
+
+
+# Function to load recently cached pair prices into a rate graph
+def load_rate_graph(max_age_minutes=30, filename=rate_cache_file):
+    graph = RateGraph()
+    cutoff = datetime.now() - timedelta(minutes=max_age_minutes)
+    for cached in read_json(filename, []):
+        if datetime.strptime(cached['date_time'], '%Y-%m-%d %H:%M:%S') >= cutoff:
+            graph.add_rate(cached['from_currency'], cached['to_currency'], cached['price'], cached.get('fee', 0.0),
+                           cached.get('source'))
+    return graph
+
+
+# Function to store freshly scraped or quoted pair prices, replacing older prices for the same pair and source
+def update_rate_cache(edges, filename=rate_cache_file):
+    current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+    def replace_edges(cached_edges):
+        cached = {(entry['from_currency'], entry['to_currency'], entry.get('source')): entry
+                  for entry in cached_edges}
+        for edge in edges:
+            cached[(edge.from_currency, edge.to_currency, edge.source)] = {
+                'date_time': current_time,
+                'from_currency': edge.from_currency,
+                'to_currency': edge.to_currency,
+                'price': edge.price,
+                'fee': edge.fee,
+                'source': edge.source,
+            }
+        return list(cached.values())
+
+    update_json(filename, replace_edges, [])
+
+
+# Function to quote every candidate intermediate coin against the final crypto at once
+def quote_candidate_edges(providers, candidates, final_crypto, amount_to, deadline_seconds=DEFAULT_QUOTE_DEADLINE):
+    edges = []
+    if not candidates:
+        return edges
+    with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+        comparisons = executor.map(
+            lambda candidate: (candidate, compare_quotes(providers, candidate, final_crypto, amount_to,
+                                                         deadline_seconds)), candidates)
+        for candidate, comparison in comparisons:
+            if comparison.best is not None:
+                edges.append(RateEdge(candidate, final_crypto, comparison.best.amount_from / amount_to,
+                                      source=comparison.best.provider))
+            else:
+                logger.info(f"No provider quoted {candidate.upper()} to {final_crypto.upper()}.")
+    return edges
+
+
+# Function to price the fiat leg of every candidate coin with one batched market price request. Market prices
+# leave out an exchange's spread, so routes through these edges are an optimistic guide until the leg is scraped.
+def fetch_fiat_edges(candidates, fiat_currency, timeout=DEFAULT_QUOTE_DEADLINE):
+    ids = {COIN_IDS[candidate]: candidate for candidate in candidates if candidate in COIN_IDS}
+    unknown = [candidate for candidate in candidates if candidate not in COIN_IDS]
+    if unknown:
+        logger.info(f"No market price source for {', '.join(unknown)}.")
+    if not ids:
+        return []
+    try:
+        response = requests.get(FIAT_PRICE_URL.format(ids=','.join(ids), fiat_currency=fiat_currency),
+                                timeout=timeout)
+        response.raise_for_status()
+        prices = response.json()
+    except (requests.RequestException, ValueError) as e:
+        logger.warning(f"Could not fetch {fiat_currency.upper()} prices for candidate coins: {e}")
+        return []
+    return [RateEdge(fiat_currency, ids[coin_id], prices[coin_id][fiat_currency], source='coingecko')
+            for coin_id in ids if prices.get(coin_id, {}).get(fiat_currency)]
@@ -0,0 +1,67 @@
+from dataclasses import dataclass
+import random
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# Raised when the overall quote budget runs out before a step could finish
+class BudgetExceeded(Exception):
+    pass
+
+
+# Raised when a step exhausts its retries or hits an error that retrying cannot fix
+class StepFailed(Exception):
+    pass
+
+
+# How a single step is retried: exponential backoff with jitter, only for the listed error types
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 3
+    attempt_timeout: float = 10.0
+    base_delay: float = 0.5
+    max_delay: float = 4.0
+    jitter: float = 0.5
+    retry_on: tuple = (Exception,)
+
+    # Backoff before the next attempt, randomly shortened by up to `jitter` of its length
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(delay * (1 - self.jitter), delay)
+
+
+# Latency budget shared by every step of one quote
+class QuoteBudget:
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(self.deadline - time.monotonic(), 0.0)
+
+
+# Function to run one step under its retry policy, giving each attempt at most the time left in the budget
+def run_step(name, step, budget, policy=RetryPolicy()):
+    last_error = None
+    for attempt in range(policy.max_attempts):
+        remaining = budget.remaining()
+        if remaining <= 0:
+            raise BudgetExceeded(f"Quote budget of {budget.seconds}s ran out during '{name}'.") from last_error
+        try:
+            return step(min(policy.attempt_timeout, remaining))
+        except policy.retry_on as e:
+            last_error = e
+            logger.warning(f"Step '{name}' attempt {attempt + 1} of {policy.max_attempts} failed: "
+                           f"{type(e).__name__}: {e}")
+        except Exception as e:
+            logger.error(f"Step '{name}' failed with a non-retryable error: {type(e).__name__}: {e}")
+            raise StepFailed(f"'{name}' failed: {e}") from e
+
+        if attempt + 1 < policy.max_attempts:
+            # Never sleep past the budget; the next loop turn reports the overrun
+            time.sleep(min(policy.delay(attempt), budget.remaining()))
+
+    logger.error(f"Step '{name}' failed after {policy.max_attempts} attempts.")
+    raise StepFailed(f"'{name}' failed after {policy.max_attempts} attempts: {last_error}") from last_error
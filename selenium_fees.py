@@ -1,4 +1,7 @@
+import asyncio
 import base64
+import copy
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from selenium import webdriver
 from selenium.webdriver.firefox.service import Service as FirefoxService
@@ -6,12 +9,33 @@ from selenium.webdriver.firefox.options import Options as FirefoxOptions
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as ec
+from selenium.common.exceptions import (TimeoutException, StaleElementReferenceException, NoSuchElementException,
+                                        ElementClickInterceptedException, JavascriptException)
 from webdriver_manager.firefox import GeckoDriverManager
 from alive_progress import alive_bar
 from dotenv import load_dotenv
+from providers import CallableProvider, build_providers, compare_quotes
+from routes import RateEdge, RateGraph, cheapest_route, load_rate_graph, quote_candidate_edges, update_rate_cache, \
+    fetch_fiat_edges
+from scheduler import QuoteBudget, RetryPolicy, run_step, BudgetExceeded, StepFailed
+from logging_setup import configure_logging, set_module_levels
+from tracing import tracer, traced, profile_run
+from metrics import metrics, METRICS_FILE, PROMETHEUS_FILE
+from estimate_server import EstimateServer
+from watch import WatchLeg, run_watch, WATCH_ALERT_EXIT_CODE
+from storage import read_json, write_json, update_json, file_lock, atomic_write_json, atomic_write_json_array
+from history import iter_entries, read_recent_entries, sort_by_time, ensure_time_ordered, READ_BLOCK_SIZE
+from compaction import compact_entries
+from merging import EntryDigest, MergeStats, UnsortedEntries, merge_sorted
+from repricing import reprice_entries, collect_legs, scenario_grid, reprice, best_quarter_hours
+from outbox import load_outbox, add_to_outbox, remove_from_outbox, start_background_flush
+from extraction import extract_google_conversion, extract_swap_amount, extract_fiat_rate
+from browser_profile import SITE_PROFILES, LEAN_PAGE_LOAD_STRATEGY, PAGE_STATS_SCRIPT, build_lean_preferences
+import tempfile
+import atexit
+import numpy as np
 import time
 import requests
-import re
 import sys
 import json
 import os
@@ -22,6 +46,15 @@ __version__ = "1.2.4"
 # Variables setup
 settings_file = 'settings.json'
 cookies_element_id = "L2AGLb"  # Change when needed
+DEFAULT_SETTINGS = {"do_setup": True, "balance": 0.0, "item_price": 0.0, "run_headless": True, "xmr_fees": 0.5,
+                    "fiat_currency": 'gbp', "initial_crypto": 'ltc', "final_crypto": 'xmr',
+                    "providers": ['exolix'], "quote_deadline": 20.0,
+                    "candidate_cryptos": ['btc', 'eth', 'ltc', 'usdt'], "quote_budget": 90.0,
+                    "lean_browser": True, "log_levels": {}, "watch_interval": 300, "watch_threshold": 0.0,
+                    "watch_exit_on_alert": True,
+                    "watch_leg_ticks": {'xmr_trade_value': 1, 'xmr_to_ltc_rate': 0, 'one_ltc_to_gbp_value': 6},
+                    "server_port": 8765, "server_cache_ttl": 60.0, "retention_days": 30, "compaction_price_band": 5.0,
+                    "metrics_textfile": PROMETHEUS_FILE}
 
 # Constants
 load_dotenv()  # Load environment variables from .env file
@@ -30,182 +63,278 @@ GITHUB_API_URL = 'https://api.github.com/repos/MDMAinsley/get_crypto_fees/conten
 GITHUB_TOKEN = os.getenv('GITHUB_TOKEN')
 HEADERS = {'Authorization': f'token {GITHUB_TOKEN}'}
 
-# Create and configure logger
-logging.basicConfig(filename="GetFees.log",
-                    format='%(asctime)s - %(levelname)s - %(message)s',
-                    filemode='w',
-                    level=logging.DEBUG)
+# Scrape errors that usually clear on a second attempt (slow page or script, re-rendered element, half-filled value)
+RETRYABLE_SCRAPE_ERRORS = (TimeoutException, StaleElementReferenceException, NoSuchElementException,
+                           ElementClickInterceptedException, JavascriptException, ValueError)
+# Retry policies for each stage of the quote
+PAGE_LOAD_POLICY = RetryPolicy(max_attempts=2, attempt_timeout=20.0, retry_on=RETRYABLE_SCRAPE_ERRORS)
+COOKIES_POLICY = RetryPolicy(max_attempts=2, attempt_timeout=10.0, retry_on=RETRYABLE_SCRAPE_ERRORS)
+PARSE_POLICY = RetryPolicy(max_attempts=5, attempt_timeout=10.0, base_delay=0.5, max_delay=2.0,
+                           retry_on=RETRYABLE_SCRAPE_ERRORS)
+
+
+# Raised when the shared dataset changed between reading its SHA and writing over it
+class UploadConflict(Exception):
+    pass
+
+
+# Uploads that lose a race with another client re-merge and retry until the deadline, which comes first
+UPLOAD_POLICY = RetryPolicy(max_attempts=100, attempt_timeout=30.0, base_delay=0.25, max_delay=8.0,
+                            retry_on=(UploadConflict, requests.ConnectionError, requests.Timeout))
+UPLOAD_DEADLINE = 120.0
+# How long the program waits on exit for the background upload of the outbox to finish
+FLUSH_EXIT_WAIT = 60.0
+# Scenario grid for --reprice: fee levels from nothing to twice the set fees, item prices from half to one and a half
+# times the set price, 51 x 41 = 2091 scenarios
+REPRICE_FEE_STEPS = 51
+REPRICE_ITEM_PRICE_STEPS = 41
+
+# Create and configure logger (named explicitly as this module usually runs as __main__)
+configure_logging()
+logger = logging.getLogger('selenium_fees')
 
 
 # Function to create the webdriver instance with necessary settings and wait conditions
-def setup_web_driver(headless):
+@traced('setup_web_driver')
+def setup_web_driver(headless, lean=True):
     # Set up Firefox options
     options = FirefoxOptions()
     if headless:
         options.add_argument("--headless")  # Enable headless mode explicitly
+    if lean:
+        # Skip images, fonts, trackers and media the selectors don't need
+        options.page_load_strategy = LEAN_PAGE_LOAD_STRATEGY
+        for preference, value in build_lean_preferences().items():
+            options.set_preference(preference, value)
 
     # Automatically downloads and sets up the latest GeckoDriver
-    service = FirefoxService(GeckoDriverManager().install())
-    driver = webdriver.Firefox(service=service, options=options)
+    with tracer.span('geckodriver install'):
+        service = FirefoxService(GeckoDriverManager().install())
+    with tracer.span('firefox startup'):
+        driver = webdriver.Firefox(service=service, options=options)
 
     # Create a WebDriverWait instance with a 10-second timeout
     wait = WebDriverWait(driver, 10)
-    logging.debug("Webdriver instance created succesfully.")
+    logger.debug(f"Webdriver instance created succesfully (lean profile: {lean}).")
     return driver, wait
 
 
+# Function to report how many requests and bytes the current page needed
+def page_load_stats(driver):
+    try:
+        return driver.execute_script(PAGE_STATS_SCRIPT)
+    except Exception as e:
+        logger.debug(f"Could not read page load stats: {e}")
+        return None
+
+
 # Function to handle different website loading on current webdriver instance
-def load_site(driver, index, xmr_trade_value, fiat_currency, initial_crypto, final_crypto, item_purchase_price):
-    if index == 0:
-        driver.get(f"https://www.google.com/search?q={item_purchase_price}{fiat_currency}+to+{final_crypto}")
-    elif index == 1:
-        driver.get(f'https://changenow.io/?from={initial_crypto}&to={final_crypto}&amountTo={xmr_trade_value}')
-        time.sleep(3)
-    elif index == 2:
-        driver.get(f'https://changenow.io/?from={fiat_currency}&to={initial_crypto}'
-                   f'&fiatMode=true&amount={item_purchase_price}')
-        time.sleep(3)
-    logging.debug(f"Site index{index}: Loaded successfully.")
+def load_site(driver, index, xmr_trade_value, fiat_currency, initial_crypto, final_crypto, item_purchase_price,
+              budget=None):
+    profile = SITE_PROFILES[index]
+    with tracer.span(f"load_site[{index}]", site=profile['name']):
+        if index == 0:
+            driver.get(f"https://www.google.com/search?q={item_purchase_price}{fiat_currency}+to+{final_crypto}")
+        elif index == 1:
+            driver.get(f'https://changenow.io/?from={initial_crypto}&to={final_crypto}&amountTo={xmr_trade_value}')
+        elif index == 2:
+            driver.get(f'https://changenow.io/?from={fiat_currency}&to={initial_crypto}'
+                       f'&fiatMode=true&amount={item_purchase_price}')
+    # Give the site's scripts time to fill in the quoted values, but no longer than the budget has left
+    settle_time = profile['settle_time'] if budget is None else min(profile['settle_time'], budget.remaining())
+    with tracer.span(f"load_site[{index}] settle", seconds=settle_time):
+        time.sleep(settle_time)
+    stats = page_load_stats(driver)
+    if stats:
+        logger.info(f"Site index{index} ({profile['name']}): {stats['requests']} requests, "
+                    f"{stats['bytes'] / 1024:.1f}KB transferred.")
+    logger.debug(f"Site index{index}: Loaded successfully.")
+    return stats
 
 
 # Function to accept Googles cookies pop-up
+@traced('accept_cookies')
 def accept_cookies(wait):
     # Wait for the accept cookies button element to be present and clickable
     cookies_button = wait.until(ec.element_to_be_clickable((By.ID, cookies_element_id)))
     cookies_button.click()
-    logging.debug("'Accept' cookies button clicked successfully.")
+    logger.debug("'Accept' cookies button clicked successfully.")
 
 
 # Function to obtain the current GBP item price in XMR using Google's latest conversion rate
-def select_and_parse_xmr_value(wait):
-    # Wait for all input elements with the specified aria-label to be present
-    input_elements = wait.until(
-        ec.presence_of_all_elements_located((By.CSS_SELECTOR, 'input[aria-label="Currency Amount Field"]')))
-    if len(input_elements) > 1:
-        # Select the second instance (index 1) if available
-        second_input_element = input_elements[1]
-        # Extract the value attribute
-        scraped_value = second_input_element.get_attribute("value")
-        xmr_trade_value = float(scraped_value)
-        logging.debug(f"XMR trade price scraped successfully: {xmr_trade_value}XMR.")
-        return xmr_trade_value
-    else:
-        logging.fatal("Less than two elements found with the specified aria-label.")
+@traced('select_and_parse_xmr_value')
+def select_and_parse_xmr_value(driver, timeout):
+    # Read the second currency amount field in one round-trip, once it holds a value
+    payload = extract_google_conversion(driver, timeout)
+    xmr_trade_value = payload.amount
+    logger.debug(f"XMR trade price scraped successfully: {xmr_trade_value}XMR.")
+    return xmr_trade_value
 
 
 # Function to obtain the current XMR item value in LTC on CHANGENOW's platform
-def select_and_parse_ltc_value(wait):
-    # Wait for the input element with the ID 'amount-field' to be present
-    amount_field = wait.until(ec.presence_of_element_located((By.ID, 'amount-field')))
-    # Extract the value attribute
-    scraped_value = amount_field.get_attribute("value")
-    xmr_to_ltc_value = float(scraped_value)
-    logging.debug(f"Successfully scraped CHANGENOW's XMR to LTC value: {xmr_to_ltc_value}")
+@traced('select_and_parse_ltc_value')
+def select_and_parse_ltc_value(driver, timeout):
+    # Read the 'amount-field' input in one round-trip, once it holds a value
+    payload = extract_swap_amount(driver, timeout)
+    xmr_to_ltc_value = payload.amount_from
+    logger.debug(f"Successfully scraped CHANGENOW's XMR to LTC value: {xmr_to_ltc_value}")
     return xmr_to_ltc_value
 
 
 # Function to obtain to current LTC to GBP trade value on CHANGENOW's platform
-def select_and_parse_gbp_value(wait, retries=5):
-    for attempt in range(retries):
+@traced('select_and_parse_gbp_value')
+def select_and_parse_gbp_value(driver, timeout, fiat_currency='gbp'):
+    # The rate hint is parsed in the page, which only answers once it shows a number before the fiat code
+    payload = extract_fiat_rate(driver, timeout, fiat_currency)
+    one_ltc_in_gbp = payload.rate
+    logger.debug(f"Successfully scraped CHANGENOW's 1LTC to GBP value: {one_ltc_in_gbp} (from '{payload.text}')")
+    return one_ltc_in_gbp
+
+
+# Function to load a site as a scheduled step, bounding the page load by the attempt's share of the budget
+def load_site_step(driver, index, budget, *site_args):
+    def step(timeout):
+        driver.set_page_load_timeout(timeout)
+        load_site(driver, index, *site_args, budget=budget)
+    run_step(f"load site {index}", step, budget, PAGE_LOAD_POLICY)
+
+
+# Function to run a page interaction as a scheduled step with a WebDriverWait sized to the attempt's timeout
+def wait_step(driver, name, func, budget, policy=PARSE_POLICY):
+    return run_step(name, lambda timeout: func(WebDriverWait(driver, timeout)), budget, policy)
+
+
+# Function to run an in-page extraction as a scheduled step, its script timeout sized to the attempt's timeout
+def extract_step(driver, name, func, budget, *args):
+    return run_step(name, lambda timeout: func(driver, timeout, *args), budget, PARSE_POLICY)
+
+
+# Function to wrap CHANGENOW's site as a quote provider, running its steps within the shared deadline.
+# It drives the one shared browser, so compare_quotes() runs it on the calling thread.
+def changenow_browser_provider(driver, fiat_currency, item_purchase_price):
+    def quote(from_currency, to_currency, amount_to, deadline):
+        budget = QuoteBudget(deadline - time.monotonic())
         try:
-            # Wait for the span element with the class name 'new-stepper-hints__rate' to be present
-            span_element = wait.until(ec.presence_of_element_located((By.CLASS_NAME, 'new-stepper-hints__rate')))
-            # Extract the text from the span element
-            span_text = span_element.text
-            # Use regular expression to extract the number after '=' and before 'GBP'
-            match = re.search(r'[=~]\s*(\d+\.?\d*)\s*GBP', span_text)
-            if match:
-                scraped_number = match.group(1)
-                one_ltc_in_gbp = float(scraped_number)
-                logging.debug(f"Successfully scraped CHANGENOW's 1LTC to GBP value: {one_ltc_in_gbp}")
-                return one_ltc_in_gbp
-            else:
-                logging.error(
-                    f"No number found in the span text. Attempt {attempt + 1} of {retries}. Text: {span_text}")
-        except ValueError as e:
-            logging.error(f"Error converting scraped number to float on attempt {attempt + 1} of {retries}. Error: {e}")
-
-        # Wait briefly before retrying to avoid overwhelming the server or repeating the same error too quickly
-        time.sleep(1)
-
-    # After retries are exhausted, log and raise an exception
-    logging.fatal(f"Failed to scrape LTC to GBP value after {retries} attempts.")
-    raise Exception(f"Failed to retrieve LTC to GBP value after {retries} attempts.")
-
-
-# Function to calculate the final price from all the scraped values
+            load_site_step(driver, 1, budget, amount_to, fiat_currency, from_currency, to_currency,
+                           item_purchase_price)
+            return extract_step(driver, "parse LTC value", select_and_parse_ltc_value, budget)
+        finally:
+            # Restore Selenium's default page load timeout for the remaining sites
+            driver.set_page_load_timeout(300)
+    return CallableProvider('changenow', quote, inline=True)
+
+
+# Function to display every provider's quote next to the cheapest one
+def display_quote_comparison(comparison, initial_crypto):
+    print_and_log(f"----------Provider Quotes----------", logger.info)
+    for quote in comparison.quotes:
+        if quote.complete:
+            marker = " (cheapest)" if quote is comparison.best else ""
+            print_and_log(f"{quote.provider}: {quote.amount_from}{initial_crypto.upper()} "
+                          f"in {quote.elapsed:.1f}s{marker}", logger.info)
+        else:
+            print_and_log(f"{quote.provider}: unavailable ({quote.error})", logger.info)
+    print()
+
+
+# Function to calculate the final price from all the scraped values, as the single route fiat -> initial -> final
+@traced('calculate_final_price')
 def calculate_final_price(one_ltc_to_gbp_value, xmr_to_ltc_rate, current_balance, xmr_fees_total):
-    gross_trade_price = one_ltc_to_gbp_value * xmr_to_ltc_rate
-    logging.debug(f"Gross trade price: £{gross_trade_price}")
+    graph = RateGraph()
+    graph.add_rate('fiat', 'initial', one_ltc_to_gbp_value)
+    # xmr_to_ltc_rate is the LTC needed for the whole XMR trade value, so route a single trade unit
+    graph.add_rate('initial', 'final', xmr_to_ltc_rate, fee=xmr_fees_total)
+    route = cheapest_route(graph, 'fiat', 'final', 1)
+    if route is None:
+        # add_rate() drops legs that scraped as zero, which leaves no route to price
+        raise ValueError(f"Cannot price the trade from scraped rates {one_ltc_to_gbp_value} and {xmr_to_ltc_rate}.")
+    gross_trade_price = route.amount_in
+    logger.debug(f"Gross trade price: £{gross_trade_price}")
     # Round to the nearest penny
     rounded_trade_price = round(gross_trade_price, 2)
-    logging.debug(f"Rounded trade price: £{rounded_trade_price}")
+    logger.debug(f"Rounded trade price: £{rounded_trade_price}")
     # Add static XMR trade fees (conservative fees estimate)
-    with_fees_trade_price = rounded_trade_price + xmr_fees_total
-    logging.debug(f"With fees trade price: £{with_fees_trade_price}")
+    with_fees_trade_price = rounded_trade_price + route.fees
+    logger.debug(f"With fees trade price: £{with_fees_trade_price}")
     # Remove current XMR balance (applies rounding again to avoid unknown float bug)
     final_trade_price = round(with_fees_trade_price - current_balance, 2)
-    logging.debug(f"Final trade price: £{final_trade_price}")
+    logger.debug(f"Final trade price: £{final_trade_price}")
     return final_trade_price
 
 
-# Function to load settings from the JSON file
+# Function to look for a cheaper intermediate coin using cached or freshly fetched fiat legs and concurrently
+# quoted crypto legs
+def find_cheaper_route(providers, candidates, fiat_currency, final_crypto, xmr_trade_value, xmr_fees_total,
+                       quote_deadline):
+    graph = load_rate_graph()
+    # The price request and the candidate quotes share one deadline
+    budget = QuoteBudget(quote_deadline)
+    # Price the fiat leg of candidates the cache has no recent price for, in one request
+    uncached = [candidate for candidate in candidates if candidate not in graph.edges.get(fiat_currency, {})]
+    fiat_edges = fetch_fiat_edges(uncached, fiat_currency, budget.remaining())
+    for edge in fiat_edges:
+        graph.add_rate(edge.from_currency, edge.to_currency, edge.price, edge.fee, edge.source)
+    # Only candidates with a known fiat price can complete a route, so skip quoting the rest
+    candidates = [candidate for candidate in candidates if candidate in graph.edges.get(fiat_currency, {})]
+    candidate_edges = []
+    if budget.remaining() > 0:
+        candidate_edges = quote_candidate_edges(providers, candidates, final_crypto, xmr_trade_value,
+                                                budget.remaining())
+    update_rate_cache(fiat_edges + candidate_edges)
+    for edge in candidate_edges:
+        graph.add_rate(edge.from_currency, edge.to_currency, edge.price, edge.fee, edge.source)
+    # Apply the fixed XMR fees to every hop that delivers the final crypto
+    for edges in graph.edges.values():
+        if final_crypto in edges:
+            edges[final_crypto].fee = xmr_fees_total
+    return cheapest_route(graph, fiat_currency, final_crypto, xmr_trade_value)
+
+
+# Function to display the cheapest route when it goes through a different intermediate coin
+def display_route_suggestion(route, initial_crypto, current_estimate):
+    if route is None or len(route.path) < 3 or route.path[1] == initial_crypto:
+        return
+    via = ' -> '.join(currency.upper() for currency in route.path)
+    if route.total < current_estimate:
+        print_and_log(f"----------Cheaper Route----------", logger.info)
+        # Market prices leave out the exchange's spread that the scraped route pays, so flag the estimate as such
+        if any(edge.source == 'coingecko' for edge in route.edges):
+            print_and_log(f"{via} would cost around £{route.total:.2f} (estimated from market prices, "
+                          f"before exchange spreads).", logger.info)
+        else:
+            print_and_log(f"{via} would cost around £{route.total:.2f}.", logger.info)
+        print()
+
+
+# Function to load settings from the JSON file, adding any missing settings in a single write
 def load_settings():
     if not os.path.exists(settings_file):
         # If the file doesn't exist, create it with default settings
-        save_settings({"do_setup": True, "balance": 0.0, "item_price": 0.0, "run_headless": True, "xmr_fees": 0.5,
-                       "fiat_currency": 'gbp', "initial_crypto": 'ltc', "final_crypto": 'xmr'})
+        save_settings(copy.deepcopy(DEFAULT_SETTINGS))
         print(f"File not found. Created new default settings file.")
-        logging.info(f"File not found. Created new default settings file.")
+        logger.info(f"File not found. Created new default settings file.")
+    # Read directly rather than through read_json(), so a corrupt file raises instead of being replaced by defaults
     with open(settings_file, 'r') as f:
         settings = json.load(f)
         print(f"Successfully loaded settings file.")
-        logging.info(f"Successfully loaded settings file.")
-    if 'do_setup' not in settings:
-        settings['do_setup'] = True
-        save_settings(settings)
-        print_and_log("Added 'do_setup' setting to the file.", logging.info)
-    if 'balance' not in settings:
-        settings['balance'] = False
-        save_settings(settings)
-        print_and_log("Added 'balance' setting to the file.", logging.info)
-    if 'item_price' not in settings:
-        settings['item_price'] = 0.0
-        save_settings(settings)
-        print_and_log("Added 'item_price' setting to the file.", logging.info)
-    if 'run_headless' not in settings:
-        settings['run_headless'] = True
+        logger.info(f"Successfully loaded settings file.")
+    missing_settings = [name for name in DEFAULT_SETTINGS if name not in settings]
+    for name in missing_settings:
+        settings[name] = copy.deepcopy(DEFAULT_SETTINGS[name])
+        print_and_log(f"Added '{name}' setting to the file.", logger.info)
+    if missing_settings:
         save_settings(settings)
-        print_and_log("Added 'run_headless' setting to the file.", logging.info)
-    if 'xmr_fees' not in settings:
-        settings['xmr_fees'] = 0.5
-        save_settings(settings)
-        print_and_log("Added 'xmr_fees' setting to the file.", logging.info)
-    if 'fiat_currency' not in settings:
-        settings['fiat_currency'] = 'gbp'
-        save_settings(settings)
-        print_and_log("Added 'fiat_currency' setting to the file.", logging.info)
-    if 'initial_crypto' not in settings:
-        settings['initial_crypto'] = 'ltc'
-        save_settings(settings)
-        print_and_log("Added 'initial_crypto' setting to the file.", logging.info)
-    if 'final_crypto' not in settings:
-        settings['final_crypto'] = 'xmr'
-        save_settings(settings)
-        print_and_log("Added 'final_crypto' setting to the file.", logging.info)
     return settings
 
 
 # Function to save settings to the JSON file
 def save_settings(settings):
-    with open(settings_file, 'w') as f:
-        json.dump(settings, f, indent=4)
+    write_json(settings_file, settings)
 
 
-# Function to change a setting in the settings file
+# Function to change a setting; changes are written together by save_settings() once the user is done
 def update_setting(new_setting, setting_name, setting_file):
     setting_file[setting_name] = new_setting
-    save_settings(setting_file)
 
 
 # Function to allow the user to alter their balance in the settings file
@@ -214,7 +343,7 @@ def check_for_balance_update(current_settings):
         # Update the balance
         new_balance = specific_input("Enter new balance: £", None, float)
         update_setting(new_balance, 'balance', current_settings)
-        print_and_log(f"Balance updated to £{new_balance}", logging.info)
+        print_and_log(f"Balance updated to £{new_balance}", logger.info)
         return new_balance
     return current_settings['balance']
 
@@ -225,7 +354,7 @@ def check_for_item_price_update(current_settings):
         # Update the balance
         new_item_price = specific_input("Enter new item price: £", None, float)
         update_setting(new_item_price, 'item_price', current_settings)
-        print_and_log(f"item Price updated to £{new_item_price}", logging.info)
+        print_and_log(f"item Price updated to £{new_item_price}", logger.info)
         return new_item_price
     return current_settings['item_price']
 
@@ -239,16 +368,16 @@ def check_for_headless_update(current_settings):
         if user_input == "y":
             if not current_settings['run_headless'] is True:
                 update_setting(True, 'run_headless', current_settings)
-                print_and_log(f"Headless value updated to True", logging.info)
+                print_and_log(f"Headless value updated to True", logger.info)
                 return True
         elif user_input == "n":
             if not current_settings['run_headless'] is False:
                 update_setting(False, 'run_headless', current_settings)
-                print_and_log(f"Headless value updated to False", logging.info)
+                print_and_log(f"Headless value updated to False", logger.info)
                 return False
         else:
             print("Invalid input.")
-            logging.error("Invalid input.")
+            logger.error("Invalid input.")
     return current_settings['run_headless']
 
 
@@ -258,7 +387,7 @@ def check_for_xmr_fees_update(current_settings):
         # Update the xmr fee price
         new_xmr_fees = specific_input("Enter new fee price: £", None, float)
         update_setting(new_xmr_fees, 'xmr_fees', current_settings)
-        print_and_log(f"XMR fees updated to £{new_xmr_fees}", logging.info)
+        print_and_log(f"XMR fees updated to £{new_xmr_fees}", logger.info)
         return new_xmr_fees
     return current_settings['xmr_fees']
 
@@ -268,7 +397,7 @@ def check_for_fiat_update(current_settings):
         # Update the fiat currency
         new_fiat_currency = specific_input("Enter fiat currency: ", None, str)
         update_setting(new_fiat_currency, 'fiat_currency', current_settings)
-        print_and_log(f"Fiat currency updated to {new_fiat_currency}", logging.info)
+        print_and_log(f"Fiat currency updated to {new_fiat_currency}", logger.info)
         return new_fiat_currency
     return current_settings['fiat_currency']
 
@@ -279,7 +408,7 @@ def check_for_initial_crypto_update(current_settings):
         # Update the initial cryptocurrency
         new_initial_crypto = specific_input("Enter initial crypto: ", None, str)
         update_setting(new_initial_crypto, 'initial_crypto', current_settings)
-        print_and_log(f"Initial Crypto updated to {new_initial_crypto}", logging.info)
+        print_and_log(f"Initial Crypto updated to {new_initial_crypto}", logger.info)
         return new_initial_crypto
     return current_settings['initial_crypto']
 
@@ -290,7 +419,7 @@ def check_for_final_crypto_update(current_settings):
         # Update the initial cryptocurrency
         new_final_crypto = specific_input("Enter final crypto: ", None, str)
         update_setting(new_final_crypto, 'final_crypto', current_settings)
-        print_and_log(f"Final Crypto updated to {new_final_crypto}", logging.info)
+        print_and_log(f"Final Crypto updated to {new_final_crypto}", logger.info)
         return new_final_crypto
     return current_settings['final_crypto']
 
@@ -306,7 +435,9 @@ def clear_console():
 
 
 # Function to save the estimated price and other relevant data to a JSON file
-def save_estimate(final_estimate, initial_product_price, fiat_curr, init_cryp, final_crypt, filename='price_data.json'):
+@traced('save_estimate')
+def save_estimate(final_estimate, initial_product_price, fiat_curr, init_cryp, final_crypt, filename='price_data.json',
+                  legs=None, xmr_fees=None):
     # Get the current date and time
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
@@ -319,82 +450,62 @@ def save_estimate(final_estimate, initial_product_price, fiat_curr, init_cryp, f
         'initial_crypto': init_cryp,
         'final_crypto': final_crypt,
     }
+    # Keep the scraped legs and the fees used so the estimate can be repriced later
+    if legs:
+        data_entry['legs'] = legs
+        data_entry['xmr_fees'] = xmr_fees
 
-    try:
-        # Try to read existing data from the file
-        with open(filename, 'r') as file:
-            data = json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # If file doesn't exist or is empty, initialize data as an empty list
-        data = []
+    # Append the new data entry under the file lock, so concurrent writers never drop each other's entries,
+    # keeping the file in time order should the clock have gone backwards
+    def append_entry(data):
+        data.append(data_entry)
+        if len(data) > 1 and data[-2]['date_time'] > current_time:
+            data = sort_by_time(data)
+        return data
 
-    # Append the new data entry
-    data.append(data_entry)
+    update_json(filename, append_entry, [])
 
-    # Write the updated data back to the file
-    with open(filename, 'w') as file:
-        json.dump(data, file, indent=4)
+    # Queue the entry for upload to the shared dataset
+    add_to_outbox(data_entry)
 
-    print_and_log("Estimated saved.", logging.info)
+    print_and_log("Estimated saved.", logger.info)
 
 
-# Function to read price data JSON and provide an estimated best time and price
+# Function to read price data JSON and provide an estimated best time and price, returned as (time, price).
+# sync=False analyses the local data as it is, report=False skips the console report.
+@traced('analyse_best_time')
 def analyse_best_time(initial_product_price, fiat_currency, initial_crypto, final_crypto, days_to_search=7, tolerance=5,
-                      tolerance_increment=10, max_retries=10, filename='price_data.json'):
+                      tolerance_increment=10, max_retries=10, filename='price_data.json', xmr_fees=None, sync=True,
+                      report=True):
     try:
         # Log initial parameters
-        logging.info(f"Starting analysis with parameters: initial_product_price={initial_product_price}, "
-                     f"fiat_currency={fiat_currency}, initial_crypto={initial_crypto}, "
-                     f"final_crypto={final_crypto}, days_to_search={days_to_search}")
-
-        # Update the price_data.json to include the most recent changes
-        sync_data()
-
-        # Read the data from the file
-        with open(filename, 'r') as file:
-            content = file.read()
-            logging.info(f"Raw JSON content: {content}")
-            data = json.loads(content)
-            logging.info(f"Parsed JSON data: {data}")
-
-        # Log the number of entries loaded
-        logging.info(f"Loaded {len(data)} entries from {filename}")
+        logger.info(f"Starting analysis with parameters: initial_product_price={initial_product_price}, "
+                    f"fiat_currency={fiat_currency}, initial_crypto={initial_crypto}, "
+                    f"final_crypto={final_crypto}, days_to_search={days_to_search}")
+
+        # Update the price_data.json to include the most recent changes; a sync rewrites it in time order,
+        # otherwise make sure it is before reading back only as far as the cutoff
+        if not (sync and sync_data(filename)):
+            ensure_time_ordered(filename)
+
+        # Calculate the date to filter entries from
+        data_to_use = datetime.now() - timedelta(days=days_to_search)
+        logger.info(f"Filtering data from the past {days_to_search} days (cutoff: {data_to_use}).")
+
+        # Read the file newest-first, stopping at the cutoff instead of loading the whole history
+        recent_data = read_recent_entries(filename, data_to_use)
     except FileNotFoundError:
-        logging.error(f"No data found in {filename}")
+        logger.error(f"No data found in {filename}")
         return
     except json.JSONDecodeError:
-        logging.error(f"Error reading data from {filename}")
+        logger.error(f"Error reading data from {filename}")
         return
 
-    # Calculate the date to filter entries from
-    data_to_use = datetime.now() - timedelta(days=days_to_search)
-    logging.info(f"Filtering data from the past {days_to_search} days (cutoff: {data_to_use}).")
-
-    # Initialize an empty list for recent_data
-    recent_data = []
-
-    # Iterate through each entry and parse date_time with logging
-    for entry in data:
-        try:
-            # Log the original and parsed date_time
-            logging.info(f"Original date_time string: {entry['date_time']}")
-            parsed_date_time = datetime.strptime(entry['date_time'], '%Y-%m-%d %H:%M:%S')
-            logging.info(f"Parsed date_time: {parsed_date_time}")
-
-            # Check if the parsed date_time is within the date range
-            if parsed_date_time >= data_to_use:
-                recent_data.append(entry)
-                logging.info(f"Entry from {parsed_date_time} added to recent_data.")
-            else:
-                logging.info(f"Entry from {parsed_date_time} is older than {data_to_use}, not added.")
-        except ValueError as e:
-            logging.error(f"Error parsing date_time for entry {entry}: {e}")
-
     # Log how many entries were found
-    logging.info(f"Total entries found within the date range: {len(recent_data)}")
+    logger.info(f"Total entries found within the date range: {len(recent_data)}")
 
     if not recent_data:
-        logging.error(f"No data found in the past {days_to_search} days.")
+        logger.error(f"No data found in the past {days_to_search} days.")
         return
 
     # Dictionary to store sums and counts of prices per quarter-hour for matching initial prices
@@ -402,18 +513,7 @@ def analyse_best_time(initial_product_price, fiat_currency, initial_crypto, fina
 
     # Function to check if a price is within a certain tolerance
     def is_within_tolerance(value1, value2, tol):
-        # Log the values and tolerance before performing the check
-        logging.info(
-            f"Checking if value {value1} is within {tol} units of value {value2}. "
-            f"Difference: {abs(value1 - value2)}")
-
-        # Perform the tolerance check
-        within_tolerance = abs(value1 - value2) <= tol
-
-        # Log the result of the tolerance check
-        logging.info(f"Result: {'Within tolerance' if within_tolerance else 'Out of tolerance'}")
-
-        return within_tolerance
+        return abs(value1 - value2) <= tol
 
     # Helper function to round time to the nearest quarter-hour
     def round_to_nearest_quarter_hour(dt):
@@ -435,19 +535,23 @@ def analyse_best_time(initial_product_price, fiat_currency, initial_crypto, fina
         ]
 
         # Log the number of filtered entries found
-        logging.info(f"Attempt {attempt + 1}: Found {len(filtered_data)} entries within {current_tolerance} tolerance.")
+        logger.info(f"Attempt {attempt + 1}: Found {len(filtered_data)} entries within {current_tolerance} tolerance.")
 
         if filtered_data:
-            logging.info(f"Data found within {current_tolerance} units of the initial product price.")
+            logger.info(f"Data found within {current_tolerance} units of the initial product price.")
             break  # If data is found, break the loop
         else:
-            logging.info(f"No data found within {current_tolerance} units of initial price. Increasing tolerance...")
+            logger.info(f"No data found within {current_tolerance} units of initial price. Increasing tolerance...")
             current_tolerance += tolerance_increment  # Increase the tolerance
     else:
         # If we complete all retries and still no data is found, exit the function
-        logging.error(f"No sufficient data even after increasing the tolerance to {current_tolerance}.")
+        logger.error(f"No sufficient data even after increasing the tolerance to {current_tolerance}.")
         return
 
+    # Reprice entries that stored their legs with the current fees, so a fee change applies to the whole history
+    if xmr_fees is not None:
+        filtered_data = reprice_entries(filtered_data, xmr_fees)
+
     # Process the filtered data to calculate averages per quarter-hour
     for entry in filtered_data:
         # Parse the date and time from the entry
@@ -463,8 +567,10 @@ def analyse_best_time(initial_product_price, fiat_currency, initial_crypto, fina
         if rounded_time not in quarter_hourly_data:
             quarter_hourly_data[rounded_time] = {'sum': 0, 'count': 0}
 
-        quarter_hourly_data[rounded_time]['sum'] += price
-        quarter_hourly_data[rounded_time]['count'] += 1
+        # Compacted entries stand for 'count' estimates averaging to their final estimate
+        count = entry.get('count', 1)
+        quarter_hourly_data[rounded_time]['sum'] += price * count
+        quarter_hourly_data[rounded_time]['count'] += count
 
     # Calculate the average price per quarter-hour for the filtered data
     quarter_hourly_averages = {
@@ -476,24 +582,28 @@ def analyse_best_time(initial_product_price, fiat_currency, initial_crypto, fina
     best_time = min(quarter_hourly_averages, key=quarter_hourly_averages.get)
     best_price = quarter_hourly_averages[best_time]
 
+    if not report:
+        return best_time, best_price
+
     hour = best_time.strftime('%H')
     am_pm = 'AM' if int(hour) < 12 else 'PM'
     formatted_time = f"{hour}:{best_time.strftime('%M')}{am_pm}"
 
-    print_and_log(f"----------Best Estimates----------", logging.info)
+    print_and_log(f"----------Best Estimates----------", logger.info)
     print_and_log(f"For {fiat_currency.upper()} to {final_crypto.upper()} via {initial_crypto.upper()}.",
-                  logging.info)
+                  logger.info)
     print_and_log(f"Best time to convert is around {formatted_time}.",
-                  logging.info)
+                  logger.info)
     print_and_log(f"For an average trade price of £{best_price:.2f}.",
-                  logging.info)
+                  logger.info)
     print()
-    print_and_log(f"----------Trade Insights----------", logging.info)
+    print_and_log(f"----------Trade Insights----------", logger.info)
     print_and_log(f"Initial trade amount - £{initial_product_price:.2f}",
-                  logging.info)
+                  logger.info)
     print_and_log(f"Total trade fees - £{best_price - initial_product_price:.2f}",
-                  logging.info)
+                  logger.info)
     print()
+    return best_time, best_price
 
 
 # Function to add a specific reply requirement onto the input function of Python
@@ -554,10 +664,11 @@ def print_and_log(message_to_print, logging_func):
     if callable(logging_func):
         logging_func(message_to_print)
     else:
-        logging.error(f"Invalid logging function specified for message: {message_to_print}")
+        logger.error(f"Invalid logging function specified for message: {message_to_print}")
 
 
 # Function to check for internet connection
+@traced('check_internet')
 def check_internet():
     try:
         requests.get('https://www.google.com/', timeout=5)
@@ -567,116 +678,386 @@ def check_internet():
 
 
 # Function to download shared data from GitHub
-def download_shared_data():
-    logging.info("Attempting to download shared data from GitHub...")
+@traced('download_shared_data')
+def download_shared_data(filename):
+    logger.info("Attempting to download shared data from GitHub...")
     try:
-        response = requests.get(RAW_GITHUB_URL, headers=HEADERS)
-        response.raise_for_status()
-        logging.info("Received response from GitHub.")
-        shared_data = response.json()  # Directly assign the response to shared_data
-        logging.info("Downloaded shared data from GitHub.")
-        return shared_data
+        # Stream the dataset to disk rather than parsing it whole in memory
+        with requests.get(RAW_GITHUB_URL, headers=HEADERS, stream=True) as response:
+            response.raise_for_status()
+            logger.info("Received response from GitHub.")
+            with open(filename, 'wb') as file:
+                for chunk in response.iter_content(READ_BLOCK_SIZE):
+                    file.write(chunk)
+        logger.info("Downloaded shared data from GitHub.")
+        return True
     except requests.HTTPError as e:
-        logging.error(f"HTTP error fetching shared data: {e}")
+        logger.error(f"HTTP error fetching shared data: {e}")
     except Exception as e:
-        logging.error(f"Error fetching shared data: {e}")
-    return None
-
-
-# Function to upload local data to GitHub
-def upload_to_github(local_data):
-    logging.info("Attempting to upload merged data to GitHub...")
+        logger.error(f"Error fetching shared data: {e}")
+    metrics.record_failure('download_shared_data')
+    return False
+
+
+# Function to write the file out of a contents API response, decoding it a block at a time. GitHub leaves the
+# content out of files over 1MB, which are then streamed raw from the blob of the same SHA.
+def download_contents(file_info, filename, timeout):
+    with open(filename, 'wb') as file:
+        if file_info.get('encoding') == 'base64' and file_info.get('content'):
+            content = file_info['content']
+            remainder = ''
+            for start in range(0, len(content), READ_BLOCK_SIZE):
+                # GitHub breaks the base64 into lines; decode whole 4-character groups and carry the rest over
+                block = remainder + ''.join(content[start:start + READ_BLOCK_SIZE].split())
+                usable = len(block) - len(block) % 4
+                file.write(base64.b64decode(block[:usable]))
+                remainder = block[usable:]
+            return
+        with requests.get(file_info['git_url'], headers={**HEADERS, 'Accept': 'application/vnd.github.raw'},
+                          stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(READ_BLOCK_SIZE):
+                file.write(chunk)
+
+
+# Function to write the contents API request body that uploads a file, base64-encoding it a block at a time
+def write_upload_body(filename, sha, body_file):
+    with open(filename, 'rb') as source, open(body_file, 'w') as body:
+        body.write(f'{{"message": "Update price_data.json", "sha": {json.dumps(sha)}, "content": "')
+        # Whole 3-byte groups per block, so the encoded blocks join without padding in between
+        for block in iter(lambda: source.read(READ_BLOCK_SIZE // 3 * 3), b''):
+            body.write(base64.b64encode(block).decode('ascii'))
+        body.write('"}')
+
+
+# Temporary file next to the data file, removed once done with
+@contextmanager
+def scratch_file(filename, prefix):
+    descriptor, path = tempfile.mkstemp(prefix=prefix, suffix='.json', dir=os.path.dirname(os.path.abspath(filename)))
+    os.close(descriptor)
     try:
-        # Load the current file SHA to make an update (GitHub requires this)
-        response = requests.get(GITHUB_API_URL, headers=HEADERS)
+        yield path
+    finally:
+        os.remove(path)
+
+
+# Function to upload the local data file to GitHub, returning whether the upload went through.
+# Every attempt merges with the shared data at the SHA it writes over, so when another client's upload lands
+# in between, the PUT is refused and the next attempt folds that client's entries in rather than dropping them.
+# The shared data, the merge and the request body all go through files, as in sync_data().
+@traced('upload_to_github')
+def upload_to_github(filename, api_url=GITHUB_API_URL, deadline=UPLOAD_DEADLINE):
+    logger.info("Attempting to upload merged data to GitHub...")
+
+    def attempt_upload(timeout):
+        # Load the current file and its SHA together (GitHub requires the SHA to make an update)
+        response = requests.get(api_url, headers=HEADERS, timeout=timeout)
         response.raise_for_status()
         file_info = response.json()
         if 'sha' not in file_info:
-            logging.error("SHA not found in response from GitHub.")
-            return
+            raise ValueError("SHA not found in response from GitHub.")
         sha = file_info['sha']
 
-        # Convert data to base64
-        encoded_data = base64.b64encode(json.dumps(local_data).encode('utf-8')).decode('utf-8')
-
-        # Upload the updated content
-        data = {
-            'message': 'Update price_data.json',
-            'content': encoded_data,
-            'sha': sha
-        }
-
-        response = requests.put(GITHUB_API_URL, headers=HEADERS, json=data)
+        with scratch_file(filename, '.shared_data.') as shared_file, \
+                scratch_file(filename, '.upload_body.') as body_file:
+            download_contents(file_info, shared_file, timeout)
+            # The content is on disk now, so let go of the response holding it
+            del file_info, response
+            # Merge and compact exactly as sync_data() does, so entries already rolled up stay rolled up
+            stats, merged_digest = merge_into_local(filename, shared_file)
+            if merged_digest == stats.base_digest:
+                logger.info("Shared data already holds every local entry.")
+                return
+
+            # Upload the updated content
+            write_upload_body(filename, sha, body_file)
+            with open(body_file, 'rb') as body:
+                response = requests.put(api_url, headers={**HEADERS, 'Content-Type': 'application/json'},
+                                        data=body, timeout=timeout)
+        if response.status_code == 409:
+            metrics.increment('getfees_upload_conflicts_total')
+            raise UploadConflict(f"Shared data changed after SHA {sha[:7]} was read.")
         response.raise_for_status()
-        logging.info("Uploaded local data to GitHub.")
-    except requests.HTTPError as e:
-        logging.error(f"Error uploading to GitHub: {e}")
-    except Exception as e:
-        logging.error(f"An unexpected error occurred: {e}")
+        logger.info("Uploaded local data to GitHub.")
+
+    try:
+        run_step('upload to github', attempt_upload, QuoteBudget(deadline), UPLOAD_POLICY)
+        return True
+    except (BudgetExceeded, StepFailed) as e:
+        logger.error(f"Error uploading to GitHub: {e}")
+    metrics.record_failure('upload_to_github')
+    return False
 
 
-# Function to merge local and shared data intelligently
+# Function to merge local and shared data held in memory, returned in time order. Syncs stream through
+# merge_into_local() instead; this is for callers that already hold both lists.
 def merge_data(local_data, shared_data):
-    # Convert shared data to a dictionary for conflict resolution
-    shared_dict = {
-        (entry['initial_product_price'], entry['final_estimate'], entry['date_time'],
-         entry['fiat_currency'], entry['initial_crypto'], entry['final_crypto']): entry for entry in shared_data
-    }
+    # Shared entries come first so they win over identical local ones
+    return list(merge_sorted([sort_by_time(shared_data), sort_by_time(local_data)]))
+
+
+# Function to stream the local entries, dropping the lot if they predate the currency fields
+def iter_local_entries(filename):
+    try:
+        entries = iter_entries(filename)
+        first = next(entries, None)
+    except FileNotFoundError:
+        return
+    if first is None:
+        return
+    # Check if the required keys exist in local data
+    keys_to_check = ['fiat_currency', 'initial_crypto', 'final_crypto']
+    if any(key not in first for key in keys_to_check):
+        logger.warning("Local data is missing required keys. Replacing with shared data.")
+        return
+    yield first
+    yield from entries
 
-    for entry in local_data:
-        key = (entry['initial_product_price'], entry['final_estimate'], entry['date_time'],
-               entry['fiat_currency'], entry['initial_crypto'], entry['final_crypto'])
 
-        # Only add entry if it's not an exact duplicate
-        if key not in shared_dict:
-            shared_dict[key] = entry
+# Function to put a JSON array file in time order, for histories written before files were kept sorted
+def sort_data_file(filename):
+    atomic_write_json(filename, sort_by_time(read_json(filename, [])))
 
-    # Convert the dictionary back to a list
-    return list(shared_dict.values())
 
+# Function to merge the shared data file and any pending entries into the local file under its lock, rolling
+# entries past the retention window into aggregates on the way through. Returns the merge stats, whose base
+# digest is the shared data's, and the digest of what was written.
+def merge_into_local(filename, shared_file, pending=()):
+    # How much raw history to keep before rolling it into aggregates
+    settings = read_json(settings_file, {})
+    retention_days = settings.get('retention_days', DEFAULT_SETTINGS['retention_days'])
+    price_band = settings.get('compaction_price_band', DEFAULT_SETTINGS['compaction_price_band'])
 
-# Main sync function
+    for attempt in range(2):
+        stats = MergeStats()
+        merged_digest = EntryDigest()
+        try:
+            with file_lock(filename):
+                merged = merge_sorted([iter_entries(shared_file), iter_local_entries(filename), pending], stats)
+                compacted = compact_entries(merged, retention_days, price_band)
+                atomic_write_json_array(filename, merged_digest.track(compacted))
+            return stats, merged_digest
+        except UnsortedEntries as e:
+            if attempt:
+                raise
+            logger.warning(f"{e} Sorting the data files before merging again.")
+        # Sorted once the failed merge has let go of the files
+        update_json(filename, sort_by_time, [])
+        sort_data_file(shared_file)
+
+
+# Main sync function, returns True once every local and outbox entry is in the shared dataset.
+# The shared and local data are streamed through a time-ordered merge and the compaction straight into the
+# rewritten local file, so memory stays flat however long the history grows.
+@traced('sync_data')
 def sync_data(filename='price_data.json'):
-    # Load local data
-    if os.path.exists(filename):
-        with open(filename, 'r') as f:
-            local_data = json.load(f)
-    else:
-        local_data = []
-
     # Check if the user has internet
-    if check_internet():
-        # Download shared data from GitHub
-        shared_data = download_shared_data()
-
-        if shared_data is not None:
-            # Check if the required keys exist in local data
-            keys_to_check = ['fiat_currency', 'initial_crypto', 'final_crypto']
-            if local_data and any(key not in local_data[0] for key in keys_to_check):
-                logging.warning("Local data is missing required keys. Replacing with shared data.")
-                # Replace local data with shared data
-                with open(filename, 'w') as f:
-                    json.dump(shared_data, f, indent=4)
-                return  # Exit the function after replacing data
-
-            # Check if shared data is the same as local data
-            if shared_data == local_data:
-                logging.info("Local data is the same as shared data. No upload needed.")
-                return  # Exit the function if data is the same
-
-            # Merge the local data with the shared data
-            merged_data = merge_data(local_data, shared_data)
-
-            # Save the merged data locally
-            with open(filename, 'w') as f:
-                json.dump(merged_data, f, indent=4)
-
-            # Upload merged data to GitHub
-            upload_to_github(merged_data)
-        else:
-            logging.info("Using local data as no shared data was available.")
-    else:
-        logging.info("No internet connection. Using local data.")
+    if not check_internet():
+        logger.info("No internet connection. Using local data.")
+        return False
+
+    # Download shared data from GitHub next to the local file
+    with scratch_file(filename, '.shared_data.') as shared_file:
+        if not download_shared_data(shared_file):
+            logger.info("Using local data as no shared data was available.")
+            metrics.record_failure('sync_data')
+            return False
+        # Entries saved since the last successful upload, coalesced into this one sync
+        pending = sort_by_time(load_outbox())
+        # Merge under the file lock so entries saved meanwhile by another process are kept
+        stats, merged_digest = merge_into_local(filename, shared_file, pending)
+
+    # Only upload when the merge or the compaction changed the shared data
+    if merged_digest == stats.base_digest:
+        logger.info("Local data is the same as shared data. No upload needed.")
+        remove_from_outbox(pending)
+        return True
+
+    # Upload merged data to GitHub
+    if upload_to_github(filename):
+        remove_from_outbox(pending)
+        return True
+    metrics.record_failure('sync_data')
+    return False
+
+
+# Function to upload every pending outbox entry in one sync, raising so the flush can back off and retry
+def flush_outbox(timeout=None):
+    if not sync_data():
+        raise ConnectionError("Shared data could not be synced.")
+
+
+# Function to keep one browser open and re-quote on an interval until the estimate is low enough or the best
+# quarter-hour comes around; returns the exit code for the program
+def run_watch_mode(settings, best_estimate):
+    fiat_currency = settings['fiat_currency']
+    initial_crypto = settings['initial_crypto']
+    final_crypto = settings['final_crypto']
+    item_purchase_price = settings['item_price']
+    threshold = settings['watch_threshold']
+    # Ticks between refreshes of each leg. By default the XMR price is read every tick, the swap is only
+    # re-quoted when that price moved, and the slow-moving fiat leg is refreshed every sixth tick.
+    leg_ticks = {**DEFAULT_SETTINGS['watch_leg_ticks'], **settings['watch_leg_ticks']}
+    driver, _ = setup_web_driver(settings['run_headless'], settings['lean_browser'])
+    cookies_accepted = False
+
+    def fetch_xmr_trade_value(values):
+        nonlocal cookies_accepted
+        budget = QuoteBudget(settings['quote_budget'])
+        load_site_step(driver, 0, budget, False, fiat_currency, initial_crypto, final_crypto, item_purchase_price)
+        # The cookie choice is remembered for the rest of the session
+        if not cookies_accepted:
+            wait_step(driver, "accept cookies", accept_cookies, budget, COOKIES_POLICY)
+            cookies_accepted = True
+        return extract_step(driver, "parse XMR value", select_and_parse_xmr_value, budget)
+
+    def fetch_xmr_to_ltc_rate(values):
+        providers = [changenow_browser_provider(driver, fiat_currency, item_purchase_price)]
+        providers += build_providers(settings['providers'])
+        comparison = compare_quotes(providers, initial_crypto, final_crypto, values['xmr_trade_value'],
+                                    settings['quote_deadline'])
+        if comparison.best is None:
+            raise Exception(f"No provider quoted {initial_crypto.upper()} to {final_crypto.upper()} in time.")
+        return comparison.best.amount_from
+
+    def fetch_one_ltc_to_gbp_value(values):
+        budget = QuoteBudget(settings['quote_budget'])
+        load_site_step(driver, 2, budget, False, fiat_currency, initial_crypto, final_crypto, item_purchase_price)
+        return extract_step(driver, "parse GBP value", select_and_parse_gbp_value, budget, fiat_currency)
+
+    legs = [
+        WatchLeg('xmr_trade_value', fetch_xmr_trade_value, leg_ticks['xmr_trade_value']),
+        WatchLeg('xmr_to_ltc_rate', fetch_xmr_to_ltc_rate, leg_ticks['xmr_to_ltc_rate'],
+                 depends_on=('xmr_trade_value',)),
+        WatchLeg('one_ltc_to_gbp_value', fetch_one_ltc_to_gbp_value, leg_ticks['one_ltc_to_gbp_value']),
+    ]
+
+    def compute(values):
+        return calculate_final_price(values['one_ltc_to_gbp_value'], values['xmr_to_ltc_rate'],
+                                     settings['balance'], settings['xmr_fees'])
+
+    def check_alert(estimate):
+        if threshold and estimate <= threshold:
+            return f"Estimate £{estimate} is at or below £{threshold}."
+        if best_estimate:
+            best_time = best_estimate[0]
+            now = datetime.now()
+            if now.hour == best_time.hour and now.minute // 15 == best_time.minute // 15:
+                return f"Now is the best quarter-hour ({best_time.strftime('%H:%M')}), estimate £{estimate}."
+        return None
+
+    def notify(alert):
+        # Terminal bell so the alert is noticed in a background window
+        print("\a", end="")
+        print_and_log(f"ALERT: {alert.reason}", logger.warning)
+
+    print_and_log(f"Watching every {settings['watch_interval']}s, press Ctrl+C to stop.", logger.info)
+    try:
+        alert = run_watch(legs, compute, settings['watch_interval'], check_alert, notify,
+                          settings['watch_exit_on_alert'])
+    finally:
+        driver.quit()
+    return WATCH_ALERT_EXIT_CODE if alert else 0
+
+
+# Function to serve estimates on this machine (127.0.0.1) from one shared browser until stopped
+def run_server_mode(settings):
+    driver = None
+    cookies_accepted = False
+
+    # Runs on the server's single backend thread, so the browser is never used concurrently
+    def fetch_legs(fiat_currency, initial_crypto, final_crypto, item_purchase_price):
+        nonlocal driver, cookies_accepted
+        if driver is None:
+            driver, _ = setup_web_driver(settings['run_headless'], settings['lean_browser'])
+        budget = QuoteBudget(settings['quote_budget'])
+        load_site_step(driver, 0, budget, False, fiat_currency, initial_crypto, final_crypto, item_purchase_price)
+        if not cookies_accepted:
+            wait_step(driver, "accept cookies", accept_cookies, budget, COOKIES_POLICY)
+            cookies_accepted = True
+        xmr_trade_value = extract_step(driver, "parse XMR value", select_and_parse_xmr_value, budget)
+        providers = [changenow_browser_provider(driver, fiat_currency, item_purchase_price)]
+        providers += build_providers(settings['providers'])
+        comparison = compare_quotes(providers, initial_crypto, final_crypto, xmr_trade_value,
+                                    min(settings['quote_deadline'], budget.remaining()))
+        if comparison.best is None:
+            raise Exception(f"No provider quoted {initial_crypto.upper()} to {final_crypto.upper()} in time.")
+        load_site_step(driver, 2, budget, False, fiat_currency, initial_crypto, final_crypto, item_purchase_price)
+        one_ltc_to_gbp_value = extract_step(driver, "parse GBP value", select_and_parse_gbp_value, budget,
+                                            fiat_currency)
+        return {'xmr_trade_value': xmr_trade_value, 'xmr_to_ltc_rate': comparison.best.amount_from,
+                'one_ltc_to_gbp_value': one_ltc_to_gbp_value, 'provider': comparison.best.provider}
+
+    def compute_estimate(legs, current_balance, xmr_fees_total):
+        return calculate_final_price(legs['one_ltc_to_gbp_value'], legs['xmr_to_ltc_rate'], current_balance,
+                                     xmr_fees_total)
+
+    # Best times come from the local data alone, so they never wait on a GitHub sync or print to the console
+    def best_time(item_purchase_price, fiat_currency, initial_crypto, final_crypto):
+        return analyse_best_time(item_purchase_price, fiat_currency, initial_crypto, final_crypto,
+                                 xmr_fees=settings['xmr_fees'], sync=False, report=False)
+
+    server = EstimateServer(fetch_legs, compute_estimate, best_time, settings['server_cache_ttl'],
+                            default_balance=settings['balance'], default_fees=settings['xmr_fees'])
+    print_and_log(f"Serving estimates on http://127.0.0.1:{settings['server_port']}, press Ctrl+C to stop.",
+                  logger.info)
+    try:
+        asyncio.run(server.serve(port=settings['server_port']))
+    except KeyboardInterrupt:
+        logger.info("Estimate server stopped by user.")
+    finally:
+        if driver is not None:
+            driver.quit()
+
+
+# Function to reprice the stored history under a grid of fee and item price scenarios in one pass and report
+# how the best quarter-hour moves with them; returns the exit code for the program
+def run_reprice_sweep(settings, filename='price_data.json', fee_steps=REPRICE_FEE_STEPS,
+                      item_price_steps=REPRICE_ITEM_PRICE_STEPS):
+    fiat_currency = settings['fiat_currency']
+    initial_crypto = settings['initial_crypto']
+    final_crypto = settings['final_crypto']
+    xmr_fees = settings['xmr_fees']
+    item_price = settings['item_price']
+    # Only entries that stored their legs can be repriced; compacted aggregates can't take another item price
+    legs = collect_legs([entry for entry in iter_local_entries(filename)
+                         if (entry['fiat_currency'], entry['initial_crypto'], entry['final_crypto'])
+                         == (fiat_currency, initial_crypto, final_crypto)])
+    if not len(legs):
+        print_and_log(f"No stored legs to reprice for {fiat_currency.upper()} to {final_crypto.upper()} via "
+                      f"{initial_crypto.upper()}.", logger.info)
+        return 1
+
+    fees = np.round(np.linspace(0.0, max(2 * xmr_fees, 1.0), fee_steps), 2)
+    item_prices = (np.round(np.linspace(0.5 * item_price, 1.5 * item_price, item_price_steps), 2)
+                   if item_price > 0 else None)
+    scenarios = scenario_grid(fees, (0.0,), item_prices)
+    started = time.perf_counter()
+    estimates = reprice(legs, scenarios)
+    quarters, best, averages = best_quarter_hours(legs, estimates)
+    elapsed = time.perf_counter() - started
+    print_and_log(f"Repriced {len(legs)} entries under {len(scenarios)} scenarios in {elapsed:.2f}s.", logger.info)
+
+    print_and_log(f"----------Best Times by Fees----------", logger.info)
+    for fee in sorted({fees[0], fees[len(fees) // 2], fees[-1], round(xmr_fees, 2)}):
+        # The scenario closest to this fee at the current item price
+        mask = np.isclose(scenarios.xmr_fees, fee)
+        if item_prices is not None:
+            mask &= np.isclose(scenarios.item_prices, item_prices[np.abs(item_prices - item_price).argmin()])
+        index = np.flatnonzero(mask)
+        if not len(index):
+            continue
+        index = index[0]
+        best_time = quarters[best[index]].astype(datetime)
+        print_and_log(f"Fees £{fee:.2f}: best around {best_time.strftime('%Y-%m-%d %H:%M')}, "
+                      f"average £{averages[index]:.2f}", logger.info)
+    # How often each quarter-hour wins across every scenario
+    winners, wins = np.unique(best, return_counts=True)
+    print_and_log(f"----------Most Frequent Best Times----------", logger.info)
+    for winner, count in sorted(zip(winners, wins), key=lambda pair: -pair[1])[:5]:
+        print_and_log(f"{quarters[winner].astype(datetime).strftime('%Y-%m-%d %H:%M')}: best in "
+                      f"{count / len(scenarios):.0%} of scenarios", logger.info)
+    return 0
 
 
 # Main program function
@@ -685,13 +1066,14 @@ def main():
         print(f"v{__version__}")
         return
     if check_internet():
-        print_and_log("Connection active.", logging.info)
+        print_and_log("Connection active.", logger.info)
     else:
-        print_and_log("Offline Mode", logging.info)
-    print_and_log(f"Running application version v{__version__}", logging.info)
+        print_and_log("Offline Mode", logger.info)
+    print_and_log(f"Running application version v{__version__}", logger.info)
     try:
         # Create or load settings file
         settings = load_settings()
+        set_module_levels(settings['log_levels'])
         # Store settings into correct variables
         do_setup = settings['do_setup']
         current_balance = settings['balance']
@@ -701,13 +1083,25 @@ def main():
         fiat_currency = settings['fiat_currency']
         initial_crypto = settings['initial_crypto']
         final_crypto = settings['final_crypto']
+        quote_deadline = settings['quote_deadline']
+        quote_budget = settings['quote_budget']
         time.sleep(2)
         clear_console()
         # Display best time estimate
-        analyse_best_time(item_purchase_price, fiat_currency, initial_crypto, final_crypto)
+        best_estimate = analyse_best_time(item_purchase_price, fiat_currency, initial_crypto, final_crypto,
+                                          xmr_fees=xmr_fees_total)
+        # Sweep the stored history across fee and item price scenarios instead of running a single estimate
+        if "--reprice" in sys.argv:
+            return run_reprice_sweep(settings)
+        # Keep re-quoting in the background instead of running a single estimate
+        if "--watch" in sys.argv:
+            return run_watch_mode(settings, best_estimate)
+        # Answer estimate requests from the team instead of running a single estimate
+        if "--serve" in sys.argv:
+            return run_server_mode(settings)
         # Present user with first time config or ask user if they need to alter settings
         if do_setup:
-            print_and_log("Running first time configuration.", logging.info)
+            print_and_log("Running first time configuration.", logger.info)
             current_balance = check_for_balance_update(settings)
             item_purchase_price = check_for_item_price_update(settings)
             run_headless = check_for_headless_update(settings)
@@ -716,6 +1110,8 @@ def main():
             initial_crypto = check_for_initial_crypto_update(settings)
             final_crypto = check_for_final_crypto_update(settings)
             update_setting(False, 'do_setup', settings)
+            # Write every change in one go
+            save_settings(settings)
         elif specific_input("Do you want to change any settings? (y/n): ", ["y", "n"]) == "y":
             current_balance = check_for_balance_update(settings)
             item_purchase_price = check_for_item_price_update(settings)
@@ -724,13 +1120,13 @@ def main():
             fiat_currency = check_for_fiat_update(settings)
             initial_crypto = check_for_initial_crypto_update(settings)
             final_crypto = check_for_final_crypto_update(settings)
+            save_settings(settings)
         clear_console()
 
         # Tasks array for the progress bar
         tasks = ["Creating webdriver instance.", f"Searching {final_crypto.upper()} rate.", "Accepting Cookies.",
                  f"Storing {final_crypto.upper()} value.",
-                 f"Searching {initial_crypto.upper()} to {final_crypto.upper()} rate.",
-                 f"Storing {final_crypto.upper()} to {initial_crypto.upper()} rate.",
+                 f"Comparing {initial_crypto.upper()} to {final_crypto.upper()} quotes.",
                  f"Searching {initial_crypto.upper()} to {fiat_currency.upper()} rate.",
                  f"Storing {initial_crypto.upper()} to {fiat_currency} rate.", "Calculating final trade price."]
 
@@ -738,71 +1134,117 @@ def main():
         with alive_bar(len(tasks), spinner='classic', bar='classic') as bar:
             current_task = 0
             bar.text = tasks[current_task]
-            logging.debug("Main function now running.")
+            logger.debug("Main function now running.")
             # Create web driver and wait instances
-            driver, wait = setup_web_driver(run_headless)
-            current_task += 1
-            bar()
-            bar.text = tasks[current_task]
-            # Search current XMR value of desired total
-            load_site(driver, 0, False, fiat_currency, initial_crypto, final_crypto, item_purchase_price)
-            current_task += 1
-            bar()
-            bar.text = tasks[current_task]
-            # Accept cookies pop up
-            accept_cookies(wait)
-            current_task += 1
-            bar()
-            bar.text = tasks[current_task]
-            # Store the current trade price in XMR value
-            xmr_trade_value = select_and_parse_xmr_value(wait)
-            current_task += 1
-            bar()
-            bar.text = tasks[current_task]
-            # Search LTC value of XMR trade price
-            load_site(driver, 1, xmr_trade_value, fiat_currency, initial_crypto, final_crypto, item_purchase_price)
-            current_task += 1
-            bar()
-            bar.text = tasks[current_task]
-            # Store the current LTC total conversion rate
-            xmr_to_ltc_rate = select_and_parse_ltc_value(wait)
-            current_task += 1
-            bar()
-            bar.text = tasks[current_task]
-            # Get CHANGENOW's LTC/GBP conversion price
-            load_site(driver, 2, False, fiat_currency, initial_crypto, final_crypto, item_purchase_price)
-            current_task += 1
-            bar()
-            bar.text = tasks[current_task]
-            # Store CHANGENOW's current LTC to GBP trade price
-            one_ltc_to_gbp_value = select_and_parse_gbp_value(wait)
-            current_task += 1
-            bar()
-            bar.text = tasks[current_task]
-            # Calculate final estimated price with fees
-            final_estimate = calculate_final_price(one_ltc_to_gbp_value, xmr_to_ltc_rate, current_balance,
-                                                   xmr_fees_total)
-            bar()
-            # Close the driver instance
-            driver.close()
+            driver, wait = setup_web_driver(run_headless, settings['lean_browser'])
+            try:
+                # Every scrape step below shares one latency budget
+                budget = QuoteBudget(quote_budget)
+                current_task += 1
+                bar()
+                bar.text = tasks[current_task]
+                # Search current XMR value of desired total
+                load_site_step(driver, 0, budget, False, fiat_currency, initial_crypto, final_crypto,
+                               item_purchase_price)
+                current_task += 1
+                bar()
+                bar.text = tasks[current_task]
+                # Accept cookies pop up
+                wait_step(driver, "accept cookies", accept_cookies, budget, COOKIES_POLICY)
+                current_task += 1
+                bar()
+                bar.text = tasks[current_task]
+                # Store the current trade price in XMR value
+                xmr_trade_value = extract_step(driver, "parse XMR value", select_and_parse_xmr_value, budget)
+                current_task += 1
+                bar()
+                bar.text = tasks[current_task]
+                # Query CHANGENOW and the configured exchanges concurrently for the LTC value of the XMR trade price
+                providers = [changenow_browser_provider(driver, fiat_currency, item_purchase_price)]
+                providers += build_providers(settings['providers'])
+                comparison = compare_quotes(providers, initial_crypto, final_crypto, xmr_trade_value,
+                                            min(quote_deadline, budget.remaining()))
+                if comparison.best is None:
+                    raise Exception(f"No provider quoted {initial_crypto.upper()} to {final_crypto.upper()} in time.")
+                # Store the cheapest LTC total conversion rate
+                xmr_to_ltc_rate = comparison.best.amount_from
+                current_task += 1
+                bar()
+                bar.text = tasks[current_task]
+                # Get CHANGENOW's LTC/GBP conversion price
+                load_site_step(driver, 2, budget, False, fiat_currency, initial_crypto, final_crypto,
+                               item_purchase_price)
+                current_task += 1
+                bar()
+                bar.text = tasks[current_task]
+                # Store CHANGENOW's current LTC to GBP trade price
+                one_ltc_to_gbp_value = extract_step(driver, "parse GBP value", select_and_parse_gbp_value, budget,
+                                                fiat_currency)
+                current_task += 1
+                bar()
+                bar.text = tasks[current_task]
+                # Calculate final estimated price with fees
+                final_estimate = calculate_final_price(one_ltc_to_gbp_value, xmr_to_ltc_rate, current_balance,
+                                                       xmr_fees_total)
+                bar()
+            finally:
+                # Quit even when the quote budget runs out, so no Firefox or geckodriver is left running
+                driver.quit()
         # Display the final estimate price
         print()
         print("------------------------------------------------------")
         print(f"Estimated trade price ~ £{final_estimate}")
         print("------------------------------------------------------")
-        logging.info(f"Estimated trade price ~ £{final_estimate}")
-        # Make user confirm closing
+        logger.info(f"Estimated trade price ~ £{final_estimate}")
         print()
+        display_quote_comparison(comparison, initial_crypto)
         # Add the current balance back to the estimate for more accurate estimated best time and price
         estimate_to_save = final_estimate + current_balance
-        save_estimate(estimate_to_save, item_purchase_price, fiat_currency, initial_crypto, final_crypto)
-        # Sync data with GitHub to merge and upload
-        sync_data()
+        legs = {'xmr_trade_value': xmr_trade_value, 'xmr_to_ltc_rate': xmr_to_ltc_rate,
+                'one_ltc_to_gbp_value': one_ltc_to_gbp_value}
+        save_estimate(estimate_to_save, item_purchase_price, fiat_currency, initial_crypto, final_crypto,
+                      legs=legs, xmr_fees=xmr_fees_total)
+        # Upload the outbox to GitHub in the background; anything left over is sent by the next run
+        flush_thread = start_background_flush(flush_outbox) if load_outbox() else None
+        # The estimate is saved by now, so a failed route search only costs the suggestion
+        try:
+            # Cache the legs used for this estimate so later runs can route through them
+            update_rate_cache([RateEdge(fiat_currency, initial_crypto, one_ltc_to_gbp_value, source='changenow'),
+                               RateEdge(initial_crypto, final_crypto, xmr_to_ltc_rate / xmr_trade_value,
+                                        source=comparison.best.provider)])
+            # Check whether another intermediate coin would currently be cheaper
+            candidates = [candidate for candidate in settings['candidate_cryptos'] if candidate != initial_crypto]
+            route = find_cheaper_route(build_providers(settings['providers']), candidates, fiat_currency,
+                                       final_crypto, xmr_trade_value, xmr_fees_total, quote_deadline)
+            display_route_suggestion(route, initial_crypto, estimate_to_save)
+        except Exception as e:
+            logger.warning(f"No route suggestion: {type(e).__name__}: {e}")
+        # Make user confirm closing
         print()
         input("Press Enter to exit...")
+        # The flush thread dies with the program, so give an upload in progress time to finish cleanly
+        if flush_thread is not None and flush_thread.is_alive():
+            print("Still uploading to the shared data...")
+            flush_thread.join(FLUSH_EXIT_WAIT)
+            if flush_thread.is_alive():
+                print_and_log("Upload not finished; the estimate stays queued for the next run.", logger.warning)
     except Exception as e:
         print(f"An error occurred: {e}")
 
 
+# Function to add this run's stage metrics onto the totals kept across runs and export them for monitoring
+def save_metrics():
+    settings = read_json(settings_file, {})
+    metrics.save(METRICS_FILE, settings.get('metrics_textfile', DEFAULT_SETTINGS['metrics_textfile']))
+
+
 if __name__ == "__main__":
-    main()
+    # The launcher asks for --version on every start; that probe is not a run of the collector
+    if "--version" not in sys.argv:
+        metrics.increment('getfees_runs_total', program='collector')
+        atexit.register(save_metrics)
+    if "--profile" in sys.argv:
+        # Time every stage and write a Chrome trace, with cProfile stats too when asked for
+        sys.exit(profile_run(main, "--cprofile" in sys.argv))
+    else:
+        sys.exit(main())
@@ -0,0 +1,132 @@
+from contextlib import contextmanager
+import tempfile
+import logging
+import json
+import time
+import os
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+logger = logging.getLogger(__name__)
+
+LOCK_TIMEOUT = 30.0
+LOCK_POLL_INTERVAL = 0.05
+
+
+# Raised when another process holds a file's lock for longer than the timeout
+class LockTimeout(Exception):
+    pass
+
+
+def _try_lock(lock_file):
+    try:
+        if os.name == 'nt':
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(lock_file):
+    if os.name == 'nt':
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+# Hold an exclusive cross-process lock on a file (through a sibling .lock file) for the enclosed block
+@contextmanager
+def file_lock(path, timeout=LOCK_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    with open(f"{path}.lock", 'a+') as lock_file:
+        while not _try_lock(lock_file):
+            if time.monotonic() >= deadline:
+                raise LockTimeout(f"Timed out after {timeout}s waiting for the lock on {path}.")
+            time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            _unlock(lock_file)
+
+
+# Function to read a JSON file, falling back to the default when it is missing or empty
+def read_json(path, default=None):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+# Function to write a JSON array one entry at a time, laid out the way json.dump() would lay it out
+def dump_json_array(entries, file, indent=None):
+    separator = ',\n' if indent is not None else ', '
+    prefix = ' ' * indent if indent is not None else ''
+    empty = True
+    for entry in entries:
+        if empty:
+            file.write('[\n' if indent is not None else '[')
+            empty = False
+        else:
+            file.write(separator)
+        file.write(prefix + json.dumps(entry, indent=indent).replace('\n', '\n' + prefix))
+    if empty:
+        file.write('[]')
+    else:
+        file.write('\n]' if indent is not None else ']')
+
+
+# Function to write a file through a temporary file renamed over the target, so readers never see half a file.
+# write(file) fills the temporary file; if it raises, the target is left untouched.
+def atomic_write(path, write):
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('w', dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp',
+                                     delete=False) as file:
+        try:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+    for attempt in range(20):
+        try:
+            os.replace(file.name, path)
+            return
+        except PermissionError:
+            # Windows refuses the rename while another process has the target open for reading
+            time.sleep(LOCK_POLL_INTERVAL)
+    os.remove(file.name)
+    raise PermissionError(f"Could not replace {path}, it stayed in use by another process.")
+
+
+# Function to atomically replace a JSON file's contents
+def atomic_write_json(path, data, indent=4):
+    atomic_write(path, lambda file: json.dump(data, file, indent=indent))
+
+
+# Function to atomically replace a JSON file with an array streamed from an iterable of entries
+def atomic_write_json_array(path, entries, indent=4):
+    atomic_write(path, lambda file: dump_json_array(entries, file, indent))
+
+
+# Function to read, change and rewrite a JSON file under its lock; update(data) returns the new data
+def update_json(path, update, default=None, indent=4):
+    with file_lock(path):
+        data = update(read_json(path, default))
+        atomic_write_json(path, data, indent)
+        return data
+
+
+# Function to replace a JSON file's contents under its lock
+def write_json(path, data, indent=4):
+    with file_lock(path):
+        atomic_write_json(path, data, indent)
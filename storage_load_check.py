@@ -0,0 +1,71 @@
+from multiprocessing import get_context
+from contextlib import redirect_stdout
+import argparse
+import tempfile
+import time
+import sys
+import os
+from storage import update_json, read_json
+from outbox import entry_id, load_outbox
+from checks import check
+import selenium_fees
+
+COUNTER_FILE = 'counter.json'
+DATA_FILE = 'price_data.json'
+
+
+# One writer process: appends to a plain JSON list through update_json() and saves estimates, which also queues
+# each one in the outbox, all in the shared directory. Returns the estimates it saved, unique to the writer.
+def run_writer(writer, writes, directory):
+    os.chdir(directory)
+    saved = []
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for index in range(writes):
+            update_json(COUNTER_FILE, lambda data: data + [[writer, index]], [])
+            final_estimate = round(50 + writer + index / 1000, 3)
+            selenium_fees.save_estimate(final_estimate, 40.0, 'gbp', 'ltc', 'xmr', filename=DATA_FILE)
+            saved.append(final_estimate)
+    return saved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Race writer processes on the local JSON files and check no "
+                                                 "write is lost or leaves a file unreadable.")
+    parser.add_argument('--processes', type=int, default=12)
+    parser.add_argument('--writes', type=int, default=40, help="writes each process makes to every file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.monotonic()
+        # Spawned rather than forked, so each writer is a fresh interpreter like a second copy of the program
+        with get_context('spawn').Pool(args.processes) as pool:
+            results = pool.starmap(run_writer, [(writer, args.writes, directory) for writer in range(args.processes)])
+        elapsed = time.monotonic() - started
+
+        expected = args.processes * args.writes
+        counter = read_json(os.path.join(directory, COUNTER_FILE))
+        data = read_json(os.path.join(directory, DATA_FILE))
+        outbox = load_outbox(os.path.join(directory, 'outbox.json'))
+        leftovers = [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+    saved = {estimate for writer_saved in results for estimate in writer_saved}
+    print(f"Processes: {args.processes}, writes each: {args.writes}, elapsed: {elapsed:.2f}s")
+    results = [
+        check(f"update_json() kept all {expected} appends",
+              counter is not None and sorted(map(tuple, counter)) == sorted(
+                  (writer, index) for writer in range(args.processes) for index in range(args.writes))),
+        check(f"save_estimate() kept all {expected} estimates",
+              data is not None and len(data) == expected
+              and {entry['final_estimate'] for entry in data} == saved),
+        check("the data file is in time order",
+              data is not None and all(a['date_time'] <= b['date_time'] for a, b in zip(data, data[1:]))),
+        check(f"the outbox queued all {expected} estimates",
+              data is not None and len(outbox) == expected
+              and {entry_id(entry) for entry in outbox} == {entry_id(entry) for entry in data}),
+        check("no temporary files were left behind", not leftovers),
+    ]
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
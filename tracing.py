@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+from functools import wraps
+import cProfile
+import threading
+import logging
+import json
+import time
+import os
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = 'GetFees.trace.json'
+CPROFILE_FILE = 'GetFees.prof'
+
+
+# Collects timed spans and exports them in the Chrome trace event format (chrome://tracing, Perfetto)
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+        self.events = []
+        self._origin = time.perf_counter()
+
+    # Time the enclosed block; every span feeds the cross-run stage metrics, and the trace when tracing is on
+    @contextmanager
+    def span(self, name, **args):
+        with metrics.timed(name):
+            if not self.enabled:
+                yield
+                return
+            start = time.perf_counter()
+            try:
+                yield
+            except BaseException as e:
+                args['error'] = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                end = time.perf_counter()
+                event = {
+                    'name': name,
+                    'cat': 'stage',
+                    'ph': 'X',
+                    'ts': (start - self._origin) * 1e6,
+                    'dur': (end - start) * 1e6,
+                    'pid': os.getpid(),
+                    'tid': threading.get_ident(),
+                    'args': args,
+                }
+                with self._lock:
+                    self.events.append(event)
+
+    def export(self, filename=TRACE_FILE):
+        with self._lock:
+            events = list(self.events)
+        with open(filename, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+        logger.info(f"Wrote {len(events)} trace spans to {filename}.")
+
+
+tracer = Tracer()
+
+
+# Decorator to run a whole function inside a span
+def traced(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Function to run the program with tracing on, optionally under cProfile, and write the results on exit
+def profile_run(func, use_cprofile=False, trace_file=TRACE_FILE, cprofile_file=CPROFILE_FILE):
+    tracer.enable()
+    profiler = cProfile.Profile() if use_cprofile else None
+    try:
+        with tracer.span('run'):
+            if profiler:
+                return profiler.runcall(func)
+            return func()
+    finally:
+        tracer.export(trace_file)
+        print(f"Trace written to {trace_file}")
+        if profiler:
+            profiler.dump_stats(cprofile_file)
+            print(f"cProfile stats written to {cprofile_file}")
@@ -0,0 +1,192 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import threading
+import argparse
+import tempfile
+import hashlib
+import base64
+import json
+import time
+import sys
+import os
+from storage import update_json
+from history import DATE_FORMAT
+from outbox import entry_id
+from checks import check
+import selenium_fees
+
+CONTENTS_PATH = '/repos/load-test/get_crypto_fees/contents/price_data.json'
+BLOBS_PATH = '/repos/load-test/get_crypto_fees/git/blobs/'
+# GitHub leaves the content out of contents API responses for files over 1MB
+INLINE_CONTENT_LIMIT = 1024 * 1024
+# Media type asking the blobs API for the bytes themselves rather than base64 in JSON
+RAW_MEDIA_TYPE = 'application/vnd.github.raw'
+
+
+# In-memory stand-in for GitHub's contents API on a single file: GET returns the content and its SHA,
+# PUT only replaces the content when given the current SHA and answers 409 otherwise
+class ContentsStore:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.blobs = {}
+        self.sha = self._store(b'[]')
+        self.commits = 0
+        self.conflicts = 0
+
+    def _store(self, content):
+        sha = hashlib.sha1(b'blob %d\0' % len(content) + content).hexdigest()
+        self.blobs[sha] = content
+        return sha
+
+    def get(self, host):
+        with self.lock:
+            sha = self.sha
+        content = self.blobs[sha]
+        inline = len(content) <= INLINE_CONTENT_LIMIT
+        return {
+            'sha': sha,
+            'size': len(content),
+            'encoding': 'base64' if inline else 'none',
+            'content': base64.b64encode(content).decode('ascii') if inline else '',
+            'git_url': f"http://{host}{BLOBS_PATH}{sha}",
+        }
+
+    def get_blob(self, sha):
+        return {'sha': sha, 'encoding': 'base64', 'content': base64.b64encode(self.blobs[sha]).decode('ascii')}
+
+    def put(self, body):
+        content = base64.b64decode(body['content'])
+        with self.lock:
+            if body.get('sha') != self.sha:
+                self.conflicts += 1
+                return 409, {'message': f"price_data.json does not match {body.get('sha')}"}
+            self.sha = self._store(content)
+            self.commits += 1
+            return 200, {'content': {'sha': self.sha}}
+
+    def entries(self):
+        return json.loads(self.blobs[self.sha])
+
+
+# Threaded server with a listen backlog deep enough for every simulated client to connect at once
+class ContentsServer(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+def make_handler(store):
+    class ContentsHandler(BaseHTTPRequestHandler):
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _reply_raw(self, content):
+            self.send_response(200)
+            self.send_header('Content-Type', RAW_MEDIA_TYPE)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def do_GET(self):
+            time.sleep(store.latency)
+            if self.path == CONTENTS_PATH:
+                self._reply(200, store.get(self.headers['Host']))
+            elif self.path.startswith(BLOBS_PATH) and self.path[len(BLOBS_PATH):] in store.blobs:
+                sha = self.path[len(BLOBS_PATH):]
+                if self.headers.get('Accept') == RAW_MEDIA_TYPE:
+                    self._reply_raw(store.blobs[sha])
+                else:
+                    self._reply(200, store.get_blob(sha))
+            else:
+                self._reply(404, {'message': 'Not Found'})
+
+        def do_PUT(self):
+            time.sleep(store.latency)
+            if self.path != CONTENTS_PATH:
+                self._reply(404, {'message': 'Not Found'})
+                return
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            self._reply(*store.put(body))
+
+        def log_message(self, format, *args):
+            pass
+
+    return ContentsHandler
+
+
+# One simulated client: saves a few estimates to its own data file, then uploads, for a number of rounds.
+# Returns every entry it saved and how many of its uploads failed.
+def run_client(client, rounds, entries_per_round, directory, api_url, deadline):
+    filename = os.path.join(directory, f"client_{client}.json")
+    saved = []
+    failed = 0
+    for round_number in range(rounds):
+        new_entries = [{
+            'date_time': datetime.now().strftime(DATE_FORMAT),
+            'final_estimate': round(50 + client + round_number / 100 + index / 10000, 4),
+            'initial_product_price': 40.0,
+            'fiat_currency': 'gbp',
+            'initial_crypto': 'ltc',
+            'final_crypto': 'xmr',
+        } for index in range(entries_per_round)]
+        update_json(filename, lambda data: data + new_entries, [])
+        saved.extend(new_entries)
+        if not selenium_fees.upload_to_github(filename, api_url=api_url, deadline=deadline):
+            failed += 1
+    return saved, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Race concurrent clients uploading to a local stand-in of GitHub's "
+                                                 "contents API and check no entry is lost.")
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--entries', type=int, default=3, help="entries saved per client per round")
+    parser.add_argument('--latency', type=float, default=0.005, help="seconds the stand-in waits per request")
+    parser.add_argument('--deadline', type=float, default=selenium_fees.UPLOAD_DEADLINE,
+                        help="seconds each upload may spend retrying conflicts")
+    args = parser.parse_args()
+
+    store = ContentsStore(args.latency)
+    server = ContentsServer(('127.0.0.1', 0), make_handler(store))
+    threading.Thread(target=server.serve_forever, name='contents-api', daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}{CONTENTS_PATH}"
+
+    with tempfile.TemporaryDirectory() as directory, ThreadPoolExecutor(max_workers=args.clients) as executor:
+        started = time.monotonic()
+        results = list(executor.map(run_client, range(args.clients), [args.rounds] * args.clients,
+                                    [args.entries] * args.clients, [directory] * args.clients,
+                                    [api_url] * args.clients, [args.deadline] * args.clients))
+        elapsed = time.monotonic() - started
+    server.shutdown()
+
+    saved_ids = {entry_id(entry) for saved, failed in results for entry in saved}
+    shared_entries = store.entries()
+    lost = len(saved_ids - {entry_id(entry) for entry in shared_entries})
+    uploads = args.clients * args.rounds
+    failed_uploads = sum(failed for saved, failed in results)
+    duplicates = len(shared_entries) - len({entry_id(entry) for entry in shared_entries})
+
+    print(f"Clients: {args.clients}, rounds: {args.rounds}, entries per round: {args.entries}")
+    print(f"Elapsed: {elapsed:.2f}s")
+    print(f"Uploads: {uploads} ({uploads / elapsed:.1f}/s), commits: {store.commits}, "
+          f"failed: {failed_uploads}")
+    print(f"Entries saved: {len(saved_ids)} ({len(saved_ids) / elapsed:.1f}/s), "
+          f"in shared data: {len(shared_entries)}, duplicates: {duplicates}")
+    print(f"Conflict retries: {store.conflicts}")
+    results = [
+        check(f"every upload went through ({failed_uploads} failed)", not failed_uploads),
+        check(f"every saved entry reached the shared data ({lost} lost)", not lost),
+        check(f"no entry was uploaded twice ({duplicates} duplicates)", not duplicates),
+    ]
+    return 0 if all(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
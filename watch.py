@@ -0,0 +1,80 @@
+from dataclasses import dataclass
+from collections import deque
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Exit code used when watch mode stops because an alert fired
+WATCH_ALERT_EXIT_CODE = 3
+
+
+# One input of the estimate, refreshed every `every` ticks or whenever a leg it depends on changed.
+# A leg with every=0 is only refreshed when a leg it depends on changed, after its first fetch.
+@dataclass
+class WatchLeg:
+    name: str
+    fetch: object
+    every: int = 1
+    depends_on: tuple = ()
+    value: float = None
+
+
+# Why and when watch mode raised an alert
+@dataclass
+class WatchAlert:
+    tick: int
+    estimate: float
+    reason: str
+
+
+# Function to refresh the legs that are due and recompute the estimate only when one of them changed.
+# Stops on the first alert when stop_on_alert is set, otherwise notifies once per alert and keeps going.
+def run_watch(legs, compute, interval, check_alert, notify, stop_on_alert=True, max_ticks=None, sleep=time.sleep):
+    values = {leg.name: leg.value for leg in legs}
+    estimate = None
+    alerting = False
+    # Only the last few tick timings are kept so memory stays flat over long runs
+    recent_ticks = deque(maxlen=20)
+    tick = 0
+    try:
+        while max_ticks is None or tick < max_ticks:
+            start = time.monotonic()
+            cpu_start = time.process_time()
+            changed = set()
+            for leg in legs:
+                due = leg.every and tick % leg.every == 0
+                if leg.value is not None and not due and not changed.intersection(leg.depends_on):
+                    continue
+                try:
+                    new_value = leg.fetch(values)
+                except Exception as e:
+                    # Keep the previous value; a single failed refresh shouldn't end the watch
+                    logger.warning(f"Tick {tick}: refreshing {leg.name} failed, keeping {leg.value}: {e}")
+                    continue
+                if new_value != leg.value:
+                    leg.value = values[leg.name] = new_value
+                    changed.add(leg.name)
+
+            if all(value is not None for value in values.values()) and (changed or estimate is None):
+                estimate = compute(values)
+
+            elapsed = time.monotonic() - start
+            recent_ticks.append((elapsed, time.process_time() - cpu_start))
+            logger.info(f"Tick {tick}: estimate £{estimate}, refreshed {sorted(changed) or 'nothing'} "
+                        f"in {elapsed:.1f}s ({recent_ticks[-1][1]:.2f}s CPU).")
+
+            reason = check_alert(estimate) if estimate is not None else None
+            if reason and not alerting:
+                alert = WatchAlert(tick, estimate, reason)
+                notify(alert)
+                if stop_on_alert:
+                    return alert
+            alerting = bool(reason)
+
+            tick += 1
+            if max_ticks is None or tick < max_ticks:
+                sleep(max(interval - (time.monotonic() - start), 0))
+    except KeyboardInterrupt:
+        logger.info(f"Watch stopped by user after {tick} ticks.")
+    return None